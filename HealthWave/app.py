@@ -4,6 +4,7 @@ from flask import Flask
 from flask_migrate import Migrate
 from extensions import db, login_manager
 from services import cancer_service, chatbot_service
+from jobs import analysis_jobs
 from werkzeug.middleware.proxy_fix import ProxyFix
 import sqlalchemy
 from sqlalchemy import exc
@@ -20,6 +21,39 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
     "mysql+mysqlconnector://root:@localhost:3306/internship_vermeg"
 )
 app.config['MODEL_DIR'] = os.path.join(app.root_path, 'models')
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'keras')  # keras, tflite, tflite-fp16, tflite-int8, onnx
+app.config['INFERENCE_THREADS'] = int(os.environ['INFERENCE_THREADS']) if os.environ.get('INFERENCE_THREADS') else None
+app.config['INFERENCE_SERVER_SOCKET'] = os.environ.get('INFERENCE_SERVER_SOCKET')  # e.g. /tmp/healthwave-inference.sock
+app.config['INFERENCE_SERVER_AUTHKEY'] = os.environ.get('INFERENCE_SERVER_AUTHKEY')
+app.config['INFERENCE_MAX_BATCH_SIZE'] = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 16))
+app.config['INFERENCE_BATCH_WAIT_MS'] = float(os.environ.get('INFERENCE_BATCH_WAIT_MS', 5))
+app.config['PREDICTION_CACHE_MAX_BYTES'] = int(os.environ.get('PREDICTION_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+app.config['PREDICTION_CACHE_PERSIST'] = os.environ.get('PREDICTION_CACHE_PERSIST', '1') == '1'
+app.config['ANALYSIS_JOB_BACKEND'] = os.environ.get('ANALYSIS_JOB_BACKEND', 'local')  # local, db
+app.config['ANALYSIS_JOB_WORKERS'] = int(os.environ.get('ANALYSIS_JOB_WORKERS', 2))
+app.config['ANALYSIS_JOB_LEASE_SECONDS'] = float(os.environ.get('ANALYSIS_JOB_LEASE_SECONDS', 600))
+app.config['MODEL_WARMUP'] = os.environ.get('MODEL_WARMUP', '0') == '1'
+app.config['MODEL_RELOAD_CHECK_INTERVAL'] = float(os.environ.get('MODEL_RELOAD_CHECK_INTERVAL', 5))
+app.config['CHAT_CONTEXT_TOKENS'] = int(os.environ.get('CHAT_CONTEXT_TOKENS', 3072))
+app.config['CHAT_SUMMARY_TOKENS'] = int(os.environ.get('CHAT_SUMMARY_TOKENS', 512))
+app.config['CHAT_MAX_TURN_TOKENS'] = int(os.environ.get('CHAT_MAX_TURN_TOKENS', 1024))
+app.config['CHAT_RETRIEVAL'] = os.environ.get('CHAT_RETRIEVAL', '1') == '1'
+app.config['CHAT_EMBEDDER'] = os.environ.get('CHAT_EMBEDDER', 'hashing')  # hashing, ollama:<embedding model>
+app.config['CHAT_CHUNK_TOKENS'] = int(os.environ.get('CHAT_CHUNK_TOKENS', 200))
+app.config['CHAT_RETRIEVAL_TOP_K'] = int(os.environ.get('CHAT_RETRIEVAL_TOP_K', 4))
+app.config['CHAT_RETRIEVAL_MIN_SCORE'] = float(os.environ.get('CHAT_RETRIEVAL_MIN_SCORE', 0.15))
+app.config['PDF_EXTRACT_WORKERS'] = int(os.environ.get('PDF_EXTRACT_WORKERS', min(4, os.cpu_count() or 1)))
+app.config['CHAT_CACHE'] = os.environ.get('CHAT_CACHE', '1') == '1'
+app.config['CHAT_CACHE_MAX_ENTRIES'] = int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', 1024))
+app.config['CHAT_CACHE_TTL'] = float(os.environ.get('CHAT_CACHE_TTL', 24 * 3600))
+app.config['CHAT_CACHE_MIN_WORDS'] = int(os.environ.get('CHAT_CACHE_MIN_WORDS', 4))
+app.config['LLM_HOST'] = os.environ.get('LLM_HOST', os.environ.get('OLLAMA_HOST'))  # e.g. http://127.0.0.1:11435 for llm_stub_server.py
+app.config['LLM_MAX_CONCURRENCY'] = int(os.environ.get('LLM_MAX_CONCURRENCY', 2))
+app.config['LLM_MAX_QUEUE'] = int(os.environ.get('LLM_MAX_QUEUE', 32))
+app.config['LLM_MAX_QUEUE_PER_USER'] = int(os.environ.get('LLM_MAX_QUEUE_PER_USER', 2))
+app.config['LLM_QUEUE_TIMEOUT'] = float(os.environ.get('LLM_QUEUE_TIMEOUT', 30))
+app.config['LLM_REQUEST_TIMEOUT'] = float(os.environ.get('LLM_REQUEST_TIMEOUT', 120))
+app.config['PDF_PARALLEL_MIN_PAGES'] = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 16))
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
@@ -45,6 +79,8 @@ def verify_db_connection():
 db.init_app(app)
 login_manager.init_app(app)
 cancer_service.init_app(app)
+chatbot_service.init_app(app)
+analysis_jobs.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'info'
@@ -61,5 +97,6 @@ with app.app_context():
         app.logger.error("Failed to connect to database after multiple attempts")
     import models
     db.create_all()
+analysis_jobs.start_recovery()
 
 import routes
\ No newline at end of file
@@ -0,0 +1,215 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from flask import Flask
+from services import CancerAnalysisService, MODEL_INPUT_SIZE, MODEL_TYPES
+
+# Offline benchmark of the analysis pipeline. Every stage is timed on its
+# own so regressions can be pinned to decode, preprocessing or inference.
+# Compare two runs with: python benchmark.py --compare old.json --output new.json
+
+
+def synthetic_image(image_type, size, seed):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    if image_type == 'lung':
+        # Two dark lobes on a bright background
+        base = 0.8 - 0.5 * (np.exp(-((x - 0.3) ** 2 + (y - 0.5) ** 2) * 12) + np.exp(-((x - 0.7) ** 2 + (y - 0.5) ** 2) * 12))
+    else:
+        # Bright skull ring around a mid-grey brain
+        r = np.sqrt((x - 0.5) ** 2 + (y - 0.5) ** 2)
+        base = np.where(r < 0.4, 0.45, 0.05) + 0.5 * np.exp(-((r - 0.41) ** 2) * 4000)
+    noise = rng.normal(0, 0.05, (size, size))
+    pixels = (np.clip(base + noise, 0, 1) * 255).astype(np.uint8)
+    return Image.fromarray(pixels).convert('RGB')
+
+
+def encode(img, fmt):
+    buffer = io.BytesIO()
+    options = {'quality': 90} if fmt == 'JPEG' else {}
+    img.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def summarize(timings, items_per_call=1):
+    timings = np.asarray(timings)
+    ms = timings * 1000.0
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+        'images_per_sec': float(items_per_call * len(timings) / timings.sum()),
+        'samples': len(timings),
+    }
+
+
+def time_calls(fn, repeats, warmup=2):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def build_service(args):
+    app = Flask('benchmark', instance_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance'))
+    app.config.update(
+        MODEL_DIR=args.model_dir,
+        INFERENCE_BACKEND=args.backend,
+        INFERENCE_MAX_BATCH_SIZE=max(args.batch_sizes),
+        INFERENCE_BATCH_WAIT_MS=args.batch_wait_ms,
+        # Every call must reach the model, so both cache tiers are off
+        PREDICTION_CACHE_MAX_BYTES=0,
+        PREDICTION_CACHE_PERSIST=False,
+        MODEL_RELOAD_CHECK_INTERVAL=float('inf'),
+    )
+    service = CancerAnalysisService(app)
+    return app, service
+
+
+def run(args):
+    app, service = build_service(args)
+    results = []
+
+    def record(stage, metrics, **labels):
+        results.append({'stage': stage, **labels, **metrics})
+        label = ' '.join(f"{k}={v}" for k, v in labels.items())
+        print(f"{stage:<12} {label:<50} p50={metrics['p50_ms']:8.3f}ms p95={metrics['p95_ms']:8.3f}ms "
+              f"p99={metrics['p99_ms']:8.3f}ms {metrics['images_per_sec']:10.1f} img/s")
+
+    with app.app_context():
+        for image_type in args.models:
+            for resolution in args.resolutions:
+                source = synthetic_image(image_type, resolution, args.seed)
+                for fmt in args.formats:
+                    data = encode(source, fmt)
+
+                    def decode():
+                        img = service._open_image(io.BytesIO(data))
+                        img.load()
+                        return img
+
+                    labels = dict(image_type=image_type, resolution=resolution, format=fmt)
+                    record('decode', summarize(time_calls(decode, args.repeats)), **labels)
+                    decoded = decode()
+                    record('preprocess', summarize(time_calls(
+                        lambda: service._preprocess_image(decoded, image_type), args.repeats)), **labels)
+
+            service._ensure_model(image_type)
+            model = getattr(service, f"{image_type}_model")
+            sample = service._preprocess_image(synthetic_image(image_type, 512, args.seed), image_type)
+            for batch_size in args.batch_sizes:
+                batch = np.repeat(sample[np.newaxis], batch_size, axis=0)
+                record('predict', summarize(time_calls(lambda: model.predict(batch), args.repeats), batch_size),
+                       image_type=image_type, batch_size=batch_size)
+
+            prediction = model.predict(sample[np.newaxis])
+            record('interpret', summarize(time_calls(
+                lambda: service._interpret_prediction(prediction, image_type), args.repeats)),
+                image_type=image_type)
+
+            # End to end through the micro-batcher with concurrent callers
+            source = synthetic_image(image_type, 512, args.seed)
+            for threads in args.threads:
+                def analyze():
+                    return service._analyze_with_model(source, image_type)
+
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    list(pool.map(lambda _: analyze(), range(threads * 2)))  # warm-up
+
+                    def timed(_):
+                        start = time.perf_counter()
+                        analyze()
+                        return time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    timings = list(pool.map(timed, range(args.repeats * threads)))
+                    elapsed = time.perf_counter() - start
+                metrics = summarize(timings)
+                metrics['images_per_sec'] = float(len(timings) / elapsed)
+                record('end_to_end', metrics, image_type=image_type, threads=threads)
+
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(row):
+    return tuple((k, row[k]) for k in ('stage', 'image_type', 'resolution', 'format', 'batch_size', 'threads') if k in row)
+
+
+def compare(baseline_path, report, tolerance):
+    with open(baseline_path) as f:
+        baseline = {result_key(row): row for row in json.load(f)['results']}
+    regressions = []
+    print(f"\nComparison against {baseline_path} (tolerance {tolerance:.0%})")
+    for row in report['results']:
+        old = baseline.get(result_key(row))
+        if old is None:
+            continue
+        change = (row['p50_ms'] - old['p50_ms']) / old['p50_ms'] if old['p50_ms'] else 0.0
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(row)
+        label = ' '.join(f"{k}={v}" for k, v in result_key(row))
+        print(f"{label:<70} p50 {old['p50_ms']:8.3f} -> {row['p50_ms']:8.3f} ms ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency/throughput benchmark for CancerAnalysisService.')
+    parser.add_argument('--model-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+    parser.add_argument('--backend', default='keras')
+    parser.add_argument('--models', nargs='+', default=list(MODEL_TYPES))
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[256, 512, 1024, 2048])
+    parser.add_argument('--formats', nargs='+', default=['JPEG', 'PNG'])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--batch-wait-ms', type=float, default=5)
+    parser.add_argument('--repeats', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='Previous results file to diff against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed p50 slowdown before flagging')
+    args = parser.parse_args()
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'input_size': list(MODEL_INPUT_SIZE),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'results': run(args),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare and compare(args.compare, report, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
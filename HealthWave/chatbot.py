@@ -0,0 +1,221 @@
+import re
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from extensions import db
+from models import ChatConversation, ConversationSummary
+
+# There is no tokenizer for the Ollama model on this side; ~4 characters per
+# token is close enough for budgeting prompts.
+CHARS_PER_TOKEN = 4
+
+_WORD_RE = re.compile(r"\w+")
+# Words that point back into the conversation: a question using them is a
+# follow-up, not a standalone question
+FOLLOW_UP_WORDS = frozenset((
+    'it', 'its', 'this', 'that', 'these', 'those', 'he', 'she', 'him', 'her', 'his', 'hers', 'they', 'them',
+    'their', 'my', 'our', 'patient', 'patients', 'above', 'previous', 'earlier', 'same', 'again', 'also',
+    'else', 'instead', 'mentioned'
+))
+
+
+def estimate_tokens(text):
+    return len(text or '') // CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:limit] + ' [...]'
+
+
+class ContextBuilder:
+    # Builds the prompt for a chat turn within a token budget: system prompt,
+    # a rolling summary of older turns, as many recent turns as fit, then the
+    # new message. When turns stop fitting, the older half of the window is
+    # folded into the summary on a background thread, so a request never
+    # waits on summarization. Summaries are stored per user and cached here.
+    MAX_CACHED_USERS = 1024
+    MAX_RECENT_ROWS = 100
+
+    def __init__(self, summarize, token_budget=3072, summary_tokens=512, max_turn_tokens=1024,
+                 include_file_content=True, app=None, logger=None):
+        self.summarize = summarize
+        self.include_file_content = include_file_content
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.max_turn_tokens = max_turn_tokens
+        self.app = app
+        self.logger = logger
+        self._summaries = OrderedDict()
+        self._compacting = set()
+        self._lock = threading.Lock()
+
+    def build(self, user_id, system_prompt, new_messages):
+        through_id, summary = self._summary(user_id)
+        messages = [{'role': 'system', 'content': system_prompt}]
+        if summary:
+            messages.append({'role': 'system', 'content': f"Summary of the earlier conversation:\n{summary}"})
+        remaining = self.token_budget - sum(estimate_tokens(m['content']) for m in messages + new_messages)
+
+        recent = []
+        overflow = False
+        rows = (ChatConversation.query
+                .filter(ChatConversation.user_id == user_id, ChatConversation.id > through_id)
+                .order_by(ChatConversation.id.desc())
+                .limit(self.MAX_RECENT_ROWS))
+        for row in rows:
+            content = self._turn_content(row)
+            cost = estimate_tokens(content)
+            if cost > remaining:
+                overflow = True
+                break
+            remaining -= cost
+            recent.append({'role': row.role, 'content': content})
+        recent.reverse()
+
+        if overflow:
+            self._schedule_compaction(user_id)
+        return messages + recent + new_messages
+
+    def _turn_content(self, row):
+        if row.is_file and not self.include_file_content:
+            # Served from the retrieval index instead
+            return f"[Uploaded file {row.file_name}]"
+        content = truncate_to_tokens(row.content, self.max_turn_tokens)
+        if row.is_file:
+            return f"[Uploaded file {row.file_name}]\n{content}"
+        return content
+
+    def _summary(self, user_id):
+        with self._lock:
+            if user_id in self._summaries:
+                self._summaries.move_to_end(user_id)
+                return self._summaries[user_id]
+        stored = db.session.get(ConversationSummary, user_id)
+        value = (stored.through_id, stored.summary) if stored else (0, '')
+        self._remember(user_id, value)
+        return value
+
+    def _remember(self, user_id, value):
+        with self._lock:
+            self._summaries[user_id] = value
+            self._summaries.move_to_end(user_id)
+            while len(self._summaries) > self.MAX_CACHED_USERS:
+                self._summaries.popitem(last=False)
+
+    def _schedule_compaction(self, user_id):
+        with self._lock:
+            if user_id in self._compacting:
+                return
+            self._compacting.add(user_id)
+        threading.Thread(target=self._compact, args=(user_id,), name=f"chat-summary-{user_id}", daemon=True).start()
+
+    def _compact(self, user_id):
+        try:
+            with self.app.app_context():
+                through_id, summary = self._summary(user_id)
+                rows = (ChatConversation.query
+                        .filter(ChatConversation.user_id == user_id, ChatConversation.id > through_id)
+                        .order_by(ChatConversation.id.desc())
+                        .all())
+                # Keep the newest half of the budget verbatim and fold the
+                # rest, so the next compaction is a while away
+                kept = 0
+                fold = []
+                for index, row in enumerate(rows):
+                    kept += estimate_tokens(self._turn_content(row))
+                    if kept > self.token_budget // 2:
+                        fold = rows[index:][::-1]
+                        break
+                if not fold:
+                    return
+
+                turns = [{'role': row.role, 'content': self._turn_content(row)} for row in fold]
+                summary = truncate_to_tokens(self.summarize(summary, turns), self.summary_tokens)
+                stored = db.session.get(ConversationSummary, user_id)
+                if stored is None:
+                    stored = ConversationSummary(user_id=user_id)
+                    db.session.add(stored)
+                stored.summary = summary
+                stored.through_id = fold[-1].id
+                stored.updated_at = datetime.utcnow()
+                db.session.commit()
+                self._remember(user_id, (stored.through_id, summary))
+                if self.logger:
+                    self.logger.info(f"Folded {len(fold)} chat turns of user {user_id} into the summary")
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Chat summary update failed for user {user_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._compacting.discard(user_id)
+
+
+class ResponseCache:
+    # Replies to standalone questions, shared across users. Whether a question
+    # is standalone is decided from the question alone: long enough and no
+    # words that refer back to the conversation. Keys hash the model, the
+    # context that shapes the answer (system prompt, retrieved excerpts) and
+    # the normalized question. Standalone questions are answered from that
+    # context only, without the doctor's summary or history, so a cached reply
+    # never carries another doctor's conversation.
+    def __init__(self, model, max_entries=1024, ttl=86400, min_words=4, logger=None):
+        self.model = model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_words = min_words
+        self.logger = logger
+        self._entries = OrderedDict()  # digest -> (expires_at, reply)
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join(_WORD_RE.findall((text or '').lower()))
+
+    def make_key(self, question, context):
+        # None for follow-ups, which must not come from (or go to) the cache
+        words = self.normalize(question).split()
+        if len(words) < self.min_words or FOLLOW_UP_WORDS.intersection(words):
+            return None
+        context_hash = hashlib.sha256(json.dumps(context).encode('utf-8')).hexdigest()
+        payload = f"{self.model}\0{context_hash}\0{' '.join(words)}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self.counters['expired'] += 1
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[1]
+
+    def put(self, key, reply):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, reply)
+            self._entries.move_to_end(key)
+            self.counters['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                'entries': len(self._entries),
+                'hit_rate': self.counters['hits'] / lookups if lookups else None,
+                **self.counters,
+            }
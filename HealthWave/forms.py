@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed
+from flask_wtf.file import FileField, FileAllowed, MultipleFileField
 from wtforms import StringField, PasswordField, SelectField, TextAreaField, DateTimeField, SubmitField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError
 from models import User
@@ -55,6 +55,13 @@ class AIAnalysisForm(FlaskForm):
     ])
     submit = SubmitField('Analyze Image')
 
+class AIBatchAnalysisForm(FlaskForm):
+    patient_id = SelectField('Patient', coerce=int, validators=[DataRequired()])
+    image_files = MultipleFileField('Study Images or Zip Archive', validators=[
+        FileAllowed(['jpg', 'jpeg', 'png', 'dcm', 'zip'], 'Only image files or zip archives are allowed!')
+    ])
+    submit = SubmitField('Analyze Study')
+
 class ChatbotForm(FlaskForm):
     message = TextAreaField('Your Message', validators=[DataRequired()], render_kw={"placeholder": "Ask a medical question..."})
     submit = SubmitField('Send')
@@ -0,0 +1,187 @@
+import hashlib
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+# File suffix of each backend's artifact, next to the original .h5 in MODEL_DIR
+BACKEND_SUFFIXES = {
+    'keras': '.h5',
+    'tflite': '.tflite',
+    'tflite-fp16': '.fp16.tflite',
+    'tflite-int8': '.int8.tflite',
+    'onnx': '.onnx',
+}
+
+
+def file_fingerprint(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InferenceBatcher:
+    # Collects concurrent single-image requests for up to `max_wait_ms` (or
+    # until `max_batch_size` is reached) and runs them through one predict call.
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5, name='inference-batcher'):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._closed = False
+
+    def submit(self, img_array):
+        future = Future()
+        # Under the lock, so nothing can be queued behind close()'s sentinel
+        # and never be answered
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+            self._queue.put((img_array, future))
+        return future
+
+    def predict(self, img_array, timeout=None):
+        return self.submit(img_array).result(timeout)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    # Drain whatever is already queued even once the window closed
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._run_batch(batch)
+                    return
+                batch.append(item)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        batch = [(arr, future) for arr, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            predictions = self.predict_fn(np.stack([arr for arr, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for i, (_, future) in enumerate(batch):
+            future.set_result(predictions[i:i + 1])
+
+
+def model_filename(image_type, backend='keras'):
+    if backend not in BACKEND_SUFFIXES:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    return f"{image_type}_model{BACKEND_SUFFIXES[backend]}"
+
+
+def load_backend(backend, path, num_threads=None):
+    if backend == 'keras':
+        return KerasBackend(path, num_threads=num_threads)
+    if backend.startswith('tflite'):
+        return TFLiteBackend(path, num_threads=num_threads)
+    if backend == 'onnx':
+        return ONNXBackend(path, num_threads=num_threads)
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, path, num_threads=None):
+        # Deferred import: TensorFlow takes seconds to import
+        import tensorflow as tf
+        if num_threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            except RuntimeError:
+                pass  # runtime already initialized by an earlier model
+        self.model = tf.keras.models.load_model(path)
+        self.input_shape = self.model.input_shape
+
+    def predict(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(None if d == -1 else int(d) for d in self._input['shape_signature'])
+        self._batch_size = int(self._input['shape'][0])
+        # An interpreter is not thread safe and owns its tensors
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = self._quantize(np.asarray(batch, dtype=np.float32), self._input)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input['index'], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output['index']).copy()
+        return self._dequantize(output, self._output)
+
+    @staticmethod
+    def _quantize(batch, details):
+        if details['dtype'] == np.float32:
+            return batch
+        scale, zero_point = details['quantization']
+        info = np.iinfo(details['dtype'])
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(details['dtype'])
+
+    @staticmethod
+    def _dequantize(output, details):
+        if output.dtype == np.float32:
+            return output
+        scale, zero_point = details['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+
+class ONNXBackend:
+    name = 'onnx'
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self.input_shape = tuple(d if isinstance(d, int) else None for d in model_input.shape)
+
+    def predict(self, batch):
+        return self.session.run(None, {self._input_name: np.asarray(batch, dtype=np.float32)})[0]
@@ -0,0 +1,226 @@
+import os
+import time
+import logging
+import argparse
+import threading
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from inference_backends import InferenceBatcher, file_fingerprint, load_backend, model_filename
+
+# One process per node owns the models and the batching scheduler; gunicorn
+# workers talk to it over a Unix socket through RemoteInferenceClient.
+MODEL_TYPES = ('lung', 'brain')
+
+logger = logging.getLogger('inference_server')
+
+
+class InferenceServer:
+    def __init__(self, model_dir, backend='keras', num_threads=None, max_batch_size=16,
+                 max_wait_ms=5, reload_check_interval=5):
+        self.model_dir = model_dir
+        self.backend = backend
+        self.num_threads = num_threads
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.reload_check_interval = reload_check_interval
+        self.models = {}
+        self.batchers = {}
+        self.fingerprints = {}
+        self.model_stats = {}
+        self._last_reload_check = {}
+        self._lock = threading.Lock()
+
+    def load(self, image_type):
+        path = os.path.join(self.model_dir, model_filename(image_type, self.backend))
+        stat = os.stat(path)
+        model = load_backend(self.backend, path, num_threads=self.num_threads)
+        old_batcher = self.batchers.get(image_type)
+        self.models[image_type] = model
+        self.fingerprints[image_type] = file_fingerprint(path)
+        self.batchers[image_type] = InferenceBatcher(
+            model.predict,
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=self.max_wait_ms,
+            name=f"{image_type}-batcher"
+        )
+        self.model_stats[image_type] = (stat.st_mtime_ns, stat.st_size)
+        if old_batcher is not None:
+            old_batcher.close()
+        logger.info(f"Loaded {image_type} model ({self.backend}), input shape {model.input_shape}")
+
+    def refresh(self, image_type):
+        now = time.monotonic()
+        if now - self._last_reload_check.get(image_type, 0) < self.reload_check_interval:
+            return
+        self._last_reload_check[image_type] = now
+        path = os.path.join(self.model_dir, model_filename(image_type, self.backend))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            if (stat.st_mtime_ns, stat.st_size) != self.model_stats[image_type]:
+                self.load(image_type)
+
+    def info(self):
+        for image_type in MODEL_TYPES:
+            self.refresh(image_type)
+        return {
+            image_type: {
+                'fingerprint': self.fingerprints[image_type],
+                'input_shape': self.models[image_type].input_shape,
+            }
+            for image_type in MODEL_TYPES
+        }
+
+    def predict(self, image_type, batch):
+        self.refresh(image_type)
+        # Every row goes through the shared batcher, so rows from different
+        # web workers end up in the same predict call
+        futures = [self.batchers[image_type].submit(img_array) for img_array in batch]
+        return np.concatenate([future.result() for future in futures])
+
+    def serve_forever(self, address, authkey):
+        # Requests are pickles, so only authenticated peers may talk to us
+        if not authkey:
+            raise ValueError('An authkey is required')
+        for image_type in MODEL_TYPES:
+            self.load(image_type)
+        if os.path.exists(address):
+            os.remove(address)
+        # Socket file is created owner-only (0600)
+        old_umask = os.umask(0o177)
+        try:
+            listener = Listener(address, family='AF_UNIX', authkey=authkey)
+        finally:
+            os.umask(old_umask)
+        with listener:
+            logger.info(f"Inference server listening on {address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.error(f"Rejected connection: {str(e)}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if request[0] == 'predict':
+                        response = ('ok', self.predict(request[1], request[2]))
+                    elif request[0] == 'info':
+                        response = ('ok', self.info())
+                    else:
+                        response = ('error', f"Unknown request: {request[0]}")
+                except Exception as e:
+                    logger.error(f"Inference request failed: {str(e)}")
+                    response = ('error', str(e))
+                try:
+                    conn.send(response)
+                except (EOFError, OSError):
+                    # Client gave up waiting and closed the connection
+                    return
+
+
+class RemoteInferenceClient:
+    # One connection per calling thread; requests on a connection are serialized.
+    def __init__(self, address, authkey=None, timeout=30):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def predict(self, image_type, batch):
+        return self._call(('predict', image_type, np.asarray(batch, dtype=np.float32)))
+
+    def info(self):
+        return self._call(('info',))
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                # No answer is pending, so a readable connection was closed
+                # by the server (e.g. it restarted)
+                stale = conn.poll(0)
+            except (EOFError, OSError):
+                stale = True
+            if stale:
+                self._drop()
+                conn = None
+        if conn is None:
+            conn = self._local.conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def _call(self, request):
+        conn = self._connection()
+        try:
+            conn.send(request)
+        except (EOFError, OSError):
+            # Nothing was sent: reconnect once
+            self._drop()
+            conn = self._connection()
+            conn.send(request)
+        try:
+            if not conn.poll(self.timeout):
+                raise TimeoutError('Inference server did not answer in time')
+            status, payload = conn.recv()
+        except (EOFError, OSError, TimeoutError):
+            # The request may still be running on the server: never send it
+            # again, and drop the connection, whose replies are now out of step
+            self._drop()
+            raise
+        if status != 'ok':
+            raise RuntimeError(payload)
+        return payload
+
+
+class RemoteModel:
+    # Same predict(batch) interface as the local backends
+    def __init__(self, client, image_type, input_shape=None):
+        self.client = client
+        self.image_type = image_type
+        self.input_shape = input_shape
+
+    def predict(self, batch):
+        return self.client.predict(self.image_type, batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared inference server for the HealthWave analysis models.')
+    parser.add_argument('--socket', default=os.environ.get('INFERENCE_SERVER_SOCKET', '/tmp/healthwave-inference.sock'))
+    parser.add_argument('--model-dir', default=os.environ.get('MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')))
+    parser.add_argument('--backend', default=os.environ.get('INFERENCE_BACKEND', 'keras'))
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--batch-wait-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    authkey = os.environ.get('INFERENCE_SERVER_AUTHKEY')
+    if not authkey:
+        parser.error('INFERENCE_SERVER_AUTHKEY must be set (shared with the web workers)')
+    server = InferenceServer(
+        args.model_dir,
+        backend=args.backend,
+        num_threads=args.threads,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.batch_wait_ms
+    )
+    server.serve_forever(args.socket, authkey=authkey.encode())
+
+
+if __name__ == '__main__':
+    main()
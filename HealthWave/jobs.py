@@ -0,0 +1,217 @@
+import os
+import io
+import time
+import queue
+import threading
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import update
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+from extensions import db
+from models import AIAnalysis
+from services import cancer_service, DICOM_EXTENSIONS
+
+
+class AnalysisJobQueue:
+    # Runs AIAnalysis jobs off the request thread. Payloads are spooled to disk
+    # for both backends. The 'local' backend hands them to an in-process queue
+    # (and re-queues spooled jobs after a restart); the 'db' backend lets any
+    # process claim queued rows (see `flask analysis-worker`). A job that stays
+    # 'running' longer than the lease belonged to a worker that died, and is
+    # failed rather than retried, so a crashing image can't loop forever.
+    def __init__(self, app=None):
+        self.app = app
+        self.backend = 'local'
+        self.num_workers = 2
+        self.poll_interval = 1.0
+        self.lease_seconds = 600
+        self.spool_dir = None
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = app.config.get('ANALYSIS_JOB_BACKEND', 'local')
+        self.num_workers = app.config.get('ANALYSIS_JOB_WORKERS', 2)
+        self.poll_interval = app.config.get('ANALYSIS_JOB_POLL_INTERVAL', 1.0)
+        self.lease_seconds = app.config.get('ANALYSIS_JOB_LEASE_SECONDS', 600)
+        self.spool_dir = os.path.join(app.instance_path, 'analysis_jobs')
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        @app.cli.command('analysis-worker')
+        @click.option('--threads', default=2, help='Number of worker threads in this process.')
+        def analysis_worker(threads):
+            """Drain queued AI analysis jobs (db backend)."""
+            self.backend = 'db'
+            self.num_workers = threads
+            self._ensure_workers()
+            for worker in self._workers:
+                worker.join()
+
+    def submit(self, image_file, patient_id, doctor_id):
+        filename = secure_filename(image_file.filename)
+        data = image_file.read()
+        if filename.lower().endswith(DICOM_EXTENSIONS):
+            import pydicom
+            # Same header-based detection as the synchronous DICOM path
+            try:
+                ds = pydicom.dcmread(io.BytesIO(data), stop_before_pixels=True)
+            except pydicom.errors.InvalidDicomError:
+                raise ValueError(f"Not a valid DICOM file: {filename}")
+            image_type = cancer_service._detect_dicom_type([(filename, None, ds)])
+        else:
+            image_type = cancer_service._detect_image_type(None, filename)
+
+        analysis = AIAnalysis(
+            patient_id=patient_id,
+            analysis_type=f"{image_type.title()} Cancer Detection",
+            image_filename=filename,
+            image_type=image_type,
+            analyzed_by=doctor_id,
+            status='queued'
+        )
+        db.session.add(analysis)
+        db.session.flush()
+        with open(self._spool_path(analysis.id), 'wb') as f:
+            f.write(data)
+        db.session.commit()
+
+        if self.backend == 'local':
+            self._queue.put((analysis.id, data))
+        self._ensure_workers()
+        return analysis
+
+    def _spool_path(self, job_id):
+        return os.path.join(self.spool_dir, f"{job_id}.bin")
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            for i in range(len(self._workers), self.num_workers):
+                target = self._run_local if self.backend == 'local' else self._run_db
+                worker = threading.Thread(target=target, name=f"analysis-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def start_recovery(self):
+        # Called once the tables exist; the db backend recovers in its poll loop
+        if self.backend == 'local':
+            threading.Thread(target=self._recover_local, name='analysis-recovery', daemon=True).start()
+
+    def _recover_local(self):
+        # After a restart: fail jobs whose worker died, re-queue the rest
+        try:
+            with self.app.app_context():
+                self._expire_leases()
+                job_ids = [row.id for row in AIAnalysis.query.with_entities(AIAnalysis.id)
+                           .filter_by(status='queued').order_by(AIAnalysis.id).all()]
+                for job_id in job_ids:
+                    data = self._read_payload(job_id)
+                    if data is not None:
+                        self._queue.put((job_id, data))
+            if job_ids:
+                self.app.logger.info(f"Re-queued {len(job_ids)} analysis jobs")
+                self._ensure_workers()
+        except Exception as e:
+            self.app.logger.error(f"Analysis job recovery failed: {str(e)}")
+
+    def _run_local(self):
+        while True:
+            job_id, data = self._queue.get()
+            try:
+                with self.app.app_context():
+                    if self._claim(job_id):
+                        self._process(job_id, data)
+            except Exception as e:
+                self.app.logger.error(f"Analysis worker error on job {job_id}: {str(e)}")
+                self._rollback()
+
+    def _run_db(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self._expire_leases()
+                    job_ids = [row.id for row in AIAnalysis.query.with_entities(AIAnalysis.id)
+                               .filter_by(status='queued').order_by(AIAnalysis.id).limit(self.num_workers).all()]
+                    claimed = next((job_id for job_id in job_ids if self._claim(job_id)), None)
+                    if claimed is not None:
+                        data = self._read_payload(claimed)
+                        if data is not None:
+                            self._process(claimed, data)
+                        continue
+            except Exception as e:
+                self.app.logger.error(f"Analysis worker error: {str(e)}")
+                self._rollback()
+            time.sleep(self.poll_interval)
+
+    def _rollback(self):
+        try:
+            with self.app.app_context():
+                db.session.rollback()
+        except Exception:
+            pass
+
+    def _read_payload(self, job_id):
+        try:
+            with open(self._spool_path(job_id), 'rb') as f:
+                return f.read()
+        except OSError as e:
+            self._fail(job_id, f"Missing job payload: {str(e)}")
+            return None
+
+    def _claim(self, job_id):
+        # Conditional UPDATE so only one worker moves a job out of 'queued'
+        result = db.session.execute(
+            update(AIAnalysis)
+            .where(AIAnalysis.id == job_id, AIAnalysis.status == 'queued')
+            .values(status='running', claimed_at=datetime.utcnow())
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _expire_leases(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        result = db.session.execute(
+            update(AIAnalysis)
+            .where(AIAnalysis.status == 'running',
+                   (AIAnalysis.claimed_at < cutoff) | (AIAnalysis.claimed_at.is_(None)))
+            .values(status='failed', error='The worker running this job stopped before it finished')
+        )
+        db.session.commit()
+        if result.rowcount:
+            self.app.logger.warning(f"Failed {result.rowcount} analysis jobs whose worker stopped")
+
+    def _process(self, job_id, data):
+        analysis = db.session.get(AIAnalysis, job_id)
+        try:
+            upload = FileStorage(stream=io.BytesIO(data), filename=analysis.image_filename)
+            analysis_data = cancer_service.analyze_image(upload, analysis.patient_id, analysis.analyzed_by)
+            for key, value in analysis_data.items():
+                setattr(analysis, key, value)
+            analysis.status = 'done'
+            db.session.commit()
+            self._remove_payload(job_id)
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.error(f"Analysis job {job_id} failed: {str(e)}")
+            self._fail(job_id, str(e))
+
+    def _fail(self, job_id, error):
+        analysis = db.session.get(AIAnalysis, job_id)
+        analysis.status = 'failed'
+        analysis.error = error
+        db.session.commit()
+        self._remove_payload(job_id)
+
+    def _remove_payload(self, job_id):
+        path = self._spool_path(job_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+analysis_jobs = AnalysisJobQueue()
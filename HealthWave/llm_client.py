@@ -0,0 +1,200 @@
+import time
+import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import httpx
+import ollama
+
+
+class LLMBusy(Exception):
+    def __init__(self, retry_after, reason='LLM is busy'):
+        super().__init__(f"{reason}, retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class LLMClient:
+    # Shared client for the local Ollama server. One HTTP connection pool for
+    # the whole process, at most max_concurrency generations in flight, and a
+    # bounded wait queue served round-robin per user so one doctor can't
+    # starve the others. Requests that can't be queued, or wait longer than
+    # queue_timeout, fail fast with LLMBusy and a retry-after estimate.
+    def __init__(self, host=None, model=None, max_concurrency=2, max_queue=32, max_queue_per_user=2,
+                 queue_timeout=30.0, request_timeout=120.0, logger=None):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self.logger = logger
+        self.client = ollama.Client(
+            host=host,
+            timeout=httpx.Timeout(request_timeout, connect=5.0),
+            limits=httpx.Limits(max_connections=max_concurrency + 2, max_keepalive_connections=max_concurrency)
+        )
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # user -> deque of waiting tickets, in round-robin order
+        self._waiting = 0
+        self._active = 0
+        self._avg_seconds = 5.0  # moving average of generation time, for retry-after
+        self.counters = {'completed': 0, 'failed': 0, 'cancelled': 0, 'rejected': 0, 'timed_out': 0}
+
+    def _retry_after(self):
+        rounds = (self._waiting + self._active) / max(self.max_concurrency, 1)
+        return max(1, int(round(rounds * self._avg_seconds)))
+
+    def admit(self, user):
+        # Cheap pre-check so a route can answer 503 before it starts streaming
+        with self._cond:
+            self._check_queue(user)
+
+    def _check_queue(self, user):
+        if self._active < self.max_concurrency and not self._waiting:
+            return
+        if self._waiting >= self.max_queue or len(self._queues.get(user, ())) >= self.max_queue_per_user:
+            self.counters['rejected'] += 1
+            if self.logger:
+                self.logger.warning(f"LLM queue full ({self._waiting} waiting), rejecting a request of {user}")
+            raise LLMBusy(self._retry_after(), 'LLM queue is full')
+
+    def _next_ticket(self):
+        for queue in self._queues.values():
+            if queue:
+                return queue[0]
+        return None
+
+    def _acquire(self, user):
+        with self._cond:
+            self._check_queue(user)
+            ticket = object()
+            self._queues.setdefault(user, deque()).append(ticket)
+            self._waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not (self._active < self.max_concurrency and self._next_ticket() is ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters['timed_out'] += 1
+                        raise LLMBusy(self._retry_after(), 'Timed out waiting for the LLM')
+                    self._cond.wait(remaining)
+            finally:
+                queue = self._queues[user]
+                queue.remove(ticket)
+                self._waiting -= 1
+                # Served or gone: this user goes to the back of the rotation
+                self._queues.move_to_end(user)
+                if not queue:
+                    del self._queues[user]
+                # The next ticket may be at the head now; let it re-check
+                self._cond.notify_all()
+            self._active += 1
+        return time.monotonic()
+
+    def _release(self, started, outcome):
+        with self._cond:
+            self._active -= 1
+            elapsed = time.monotonic() - started
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+            self.counters[outcome] += 1
+            self._cond.notify_all()
+
+    def chat(self, user, messages, on_start=None, **options):
+        # on_start runs once a slot is held, before the request is sent
+        started = self._acquire(user)
+        outcome = 'failed'
+        try:
+            if on_start:
+                on_start()
+            response = self.client.chat(model=self.model, messages=messages, stream=False, options=options or None)
+            outcome = 'completed'
+            return response['message']['content']
+        finally:
+            self._release(started, outcome)
+
+    def stream_chat(self, user, messages, on_start=None, **options):
+        # Generator; the slot is held from the first token request until the
+        # generator finishes or is closed (client gone), which also closes
+        # the HTTP stream so Ollama stops generating
+        started = self._acquire(user)
+        outcome = 'failed'
+        stream = None
+        try:
+            if on_start:
+                on_start()
+            stream = self.client.chat(model=self.model, messages=messages, stream=True, options=options or None)
+            for part in stream:
+                token = part['message']['content']
+                if token:
+                    yield token
+            outcome = 'completed'
+        except GeneratorExit:
+            outcome = 'cancelled'
+            raise
+        finally:
+            if stream is not None:
+                stream.close()
+            self._release(started, outcome)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'max_concurrency': self.max_concurrency,
+                'avg_generation_s': self._avg_seconds,
+                **self.counters,
+            }
+
+
+def main():
+    # Load test: simulated doctors chatting concurrently through one client.
+    # Run against llm_stub_server.py to measure the client without a model.
+    parser = argparse.ArgumentParser(description='Concurrent chat load test through LLMClient.')
+    parser.add_argument('--host', default='http://127.0.0.1:11435')
+    parser.add_argument('--model', default='stub')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--requests-per-user', type=int, default=5)
+    parser.add_argument('--max-concurrency', type=int, default=2)
+    parser.add_argument('--max-queue', type=int, default=32)
+    parser.add_argument('--queue-timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    client = LLMClient(args.host, args.model, args.max_concurrency, args.max_queue,
+                       queue_timeout=args.queue_timeout)
+    first_token, totals, busy = [], [], []
+    lock = threading.Lock()
+
+    def doctor(user):
+        for i in range(args.requests_per_user):
+            start = time.perf_counter()
+            try:
+                stream = client.stream_chat(user, [{'role': 'user', 'content': f"question {i} from {user}"}])
+                next(stream)
+                ttft = time.perf_counter() - start
+                for _ in stream:
+                    pass
+                with lock:
+                    first_token.append(ttft)
+                    totals.append(time.perf_counter() - start)
+            except LLMBusy as e:
+                with lock:
+                    busy.append(e.retry_after)
+                time.sleep(min(e.retry_after, 1))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(doctor, [f"user-{u}" for u in range(args.users)]))
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(totals)} completed, {len(busy)} busy in {elapsed:.1f}s ({len(totals) / elapsed:.2f} req/s)")
+    if totals:
+        print(f"time to first token p50 {np.percentile(first_token, 50) * 1000:.0f}ms "
+              f"p95 {np.percentile(first_token, 95) * 1000:.0f}ms; "
+              f"total p50 {np.percentile(totals, 50):.2f}s p95 {np.percentile(totals, 95):.2f}s")
+    print(client.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import json
+import time
+import zlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal Ollama-compatible server for load tests without a model: /api/chat
+# (streamed NDJSON or a single JSON reply) and /api/embed. Replies are a fixed
+# number of filler tokens at a fixed rate, so runs are comparable.
+#
+#   python llm_stub_server.py --port 11435 --tokens 120 --token-ms 25
+#   LLM_HOST=http://127.0.0.1:11435 python app.py
+
+WORDS = ('the', 'patient', 'should', 'follow', 'up', 'with', 'a', 'specialist', 'for', 'further',
+         'evaluation', 'of', 'symptoms', 'and', 'dosage', 'adjustment')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    tokens = 120
+    token_ms = 25.0
+    first_token_ms = 200.0
+    max_concurrent = 0
+    active = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/version':
+            self._send_json(200, {'version': '0.0.0-stub'})
+        elif self.path == '/api/tags':
+            self._send_json(200, {'models': []})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        request = self._read_json()
+        if self.path == '/api/chat':
+            self._chat(request)
+        elif self.path == '/api/embed':
+            self._embed(request)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _part(self, model, content, done):
+        part = {
+            'model': model,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'message': {'role': 'assistant', 'content': content},
+            'done': done,
+        }
+        if done:
+            part.update(done_reason='stop', eval_count=self.tokens)
+        return part
+
+    def _chat(self, request):
+        cls = type(self)
+        # Like Ollama with OLLAMA_NUM_PARALLEL: too many at once is an error
+        with cls.lock:
+            busy = cls.max_concurrent and cls.active >= cls.max_concurrent
+            if not busy:
+                cls.active += 1
+        if busy:
+            self._send_json(503, {'error': 'server busy'})
+            return
+        try:
+            model = request.get('model', 'stub')
+            num_predict = (request.get('options') or {}).get('num_predict') or self.tokens
+            count = min(self.tokens, num_predict)
+            time.sleep(self.first_token_ms / 1000)
+            if not request.get('stream', True):
+                time.sleep(count * self.token_ms / 1000)
+                self._send_json(200, self._part(model, ' '.join(WORDS[i % len(WORDS)] for i in range(count)), True))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for i in range(count):
+                    self._chunk(self._part(model, WORDS[i % len(WORDS)] + ' ', False))
+                    time.sleep(self.token_ms / 1000)
+                self._chunk(self._part(model, '', True))
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                # Client cancelled
+                self.close_connection = True
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def _chunk(self, payload):
+        line = json.dumps(payload).encode() + b'\n'
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b'\r\n')
+        self.wfile.flush()
+
+    def _embed(self, request):
+        inputs = request.get('input') or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        # Deterministic pseudo-embeddings: same text, same vector
+        embeddings = [[((zlib.crc32(f"{text}:{i}".encode()) % 2001) - 1000) / 1000 for i in range(64)]
+                      for text in inputs]
+        self._send_json(200, {'model': request.get('model', 'stub'), 'embeddings': embeddings})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ollama-compatible stub server for chat load tests.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--tokens', type=int, default=120, help='Tokens per reply')
+    parser.add_argument('--token-ms', type=float, default=25.0, help='Delay between tokens')
+    parser.add_argument('--first-token-ms', type=float, default=200.0, help='Delay before the first token')
+    parser.add_argument('--max-concurrent', type=int, default=0,
+                        help='Reject chats beyond this many in flight (0 = unlimited)')
+    args = parser.parse_args()
+
+    StubHandler.tokens = args.tokens
+    StubHandler.token_ms = args.token_ms
+    StubHandler.first_token_ms = args.first_token_ms
+    StubHandler.max_concurrent = args.max_concurrent
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Stub LLM server on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
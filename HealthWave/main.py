@@ -1,4 +1,7 @@
-from app import app
+# PDF worker processes (pdf_text) re-run this file as __mp_main__; they must
+# not build the whole app
+if __name__ != '__mp_main__':
+    from app import app
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,38 @@
+"""Add prediction cache
+
+Revision ID: 3f2a9c7d1b44
+Revises: 1195506c0e25
+Create Date: 2026-10-16 10:12:40.183022
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c7d1b44'
+down_revision = '1195506c0e25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('prediction_cache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cache_key', sa.String(length=64), nullable=False),
+    sa.Column('image_type', sa.String(length=20), nullable=False),
+    sa.Column('model_fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('prediction', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('cache_key')
+    )
+    with op.batch_alter_table('prediction_cache', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_prediction_cache_model_fingerprint'), ['model_fingerprint'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('prediction_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_prediction_cache_model_fingerprint'))
+
+    op.drop_table('prediction_cache')
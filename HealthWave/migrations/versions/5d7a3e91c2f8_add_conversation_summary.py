@@ -0,0 +1,31 @@
+"""Add conversation summary
+
+Revision ID: 5d7a3e91c2f8
+Revises: 8c1e4b2f6a90
+Create Date: 2026-10-16 15:24:51.130482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7a3e91c2f8'
+down_revision = '8c1e4b2f6a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversation_summary',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=False),
+    sa.Column('through_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('conversation_summary')
@@ -0,0 +1,28 @@
+"""Add analysis job status
+
+Revision ID: 8c1e4b2f6a90
+Revises: 3f2a9c7d1b44
+Create Date: 2026-10-16 11:02:17.542913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e4b2f6a90'
+down_revision = '3f2a9c7d1b44'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ai_analysis', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=20), server_default='done', nullable=False))
+        batch_op.add_column(sa.Column('error', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('ai_analysis', schema=None) as batch_op:
+        batch_op.drop_column('error')
+        batch_op.drop_column('status')
@@ -0,0 +1,26 @@
+"""Add analysis job claimed_at
+
+Revision ID: a4c9e2d71b35
+Revises: 5d7a3e91c2f8
+Create Date: 2026-10-16 23:20:41.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c9e2d71b35'
+down_revision = '5d7a3e91c2f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ai_analysis', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('claimed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('ai_analysis', schema=None) as batch_op:
+        batch_op.drop_column('claimed_at')
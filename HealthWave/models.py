@@ -107,11 +107,26 @@ class AIAnalysis(db.Model):
     recommendations = db.Column(db.Text)
     analyzed_at = db.Column(db.DateTime, default=datetime.utcnow)
     analyzed_by = db.Column(db.Integer, db.ForeignKey('user.id'))  
+    status = db.Column(db.String(20), nullable=False, default='done', server_default='done')  # queued, running, done, failed
+    error = db.Column(db.Text)
+    claimed_at = db.Column(db.DateTime)  # when a worker took the job; stale 'running' rows are failed
     patient = db.relationship('User', foreign_keys=[patient_id], backref='analyses_as_patient')
     doctor = db.relationship('User', foreign_keys=[analyzed_by], backref='analyses_as_doctor')
     def __repr__(self):
         return f'<AIAnalysis {self.id}: {self.analysis_type}>'
     
+class PredictionCacheEntry(db.Model):
+    __tablename__ = 'prediction_cache'
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), unique=True, nullable=False)  # sha256(model fingerprint + pixels)
+    image_type = db.Column(db.String(20), nullable=False)  # lung, brain
+    model_fingerprint = db.Column(db.String(64), nullable=False, index=True)
+    prediction = db.Column(db.Text, nullable=False)  # JSON list with the raw model output
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PredictionCacheEntry {self.id}: {self.image_type}>'
+
 class ChatConversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -125,3 +140,13 @@ class ChatConversation(db.Model):
     
     def __repr__(self):
         return f'<ChatConversation {self.id}: {self.role}>'
+
+class ConversationSummary(db.Model):
+    __tablename__ = 'conversation_summary'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    summary = db.Column(db.Text, nullable=False, default='')
+    through_id = db.Column(db.Integer, nullable=False, default=0)  # last ChatConversation.id folded in
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ConversationSummary {self.user_id}: through {self.through_id}>'
@@ -0,0 +1,65 @@
+import os
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+
+# PDF text extraction straight from the uploaded bytes. Large documents are
+# split into page ranges extracted in worker processes (MuPDF is not
+# thread-safe, and holds the GIL anyway). Results are cached on disk by the
+# SHA-256 of the file, so re-uploading a document costs a hash.
+
+
+def extract_page_range(data, start, stop):
+    with fitz.open(stream=data, filetype='pdf') as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+class PDFTextExtractor:
+    def __init__(self, cache_dir=None, workers=0, parallel_min_pages=16, logger=None):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.parallel_min_pages = parallel_min_pages
+        self.logger = logger
+        self._pool = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Not fork: the web process has threads and open DB connections
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._pool
+
+    def extract(self, data):
+        key = hashlib.sha256(data).hexdigest()
+        if self.cache_dir and os.path.exists(self._cache_path(key)):
+            with open(self._cache_path(key), encoding='utf-8') as f:
+                return f.read()
+
+        with fitz.open(stream=data, filetype='pdf') as doc:
+            page_count = doc.page_count
+            if self.workers and page_count >= self.parallel_min_pages:
+                pages = None
+            else:
+                pages = [page.get_text() for page in doc]
+        if pages is None:
+            step = -(-page_count // self.workers)
+            ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            futures = [self._get_pool().submit(extract_page_range, data, start, stop) for start, stop in ranges]
+            pages = [text for future in futures for text in future.result()]
+        text = ''.join(pages)
+
+        if self.cache_dir:
+            tmp_path = f"{self._cache_path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self._cache_path(key))
+        if self.logger:
+            self.logger.info(f"Extracted {page_count} PDF pages ({len(text)} characters)")
+        return text
@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from chatbot import CHARS_PER_TOKEN
+
+# Per-user retrieval index over uploaded documents. Documents are split into
+# overlapping chunks, embedded locally and appended to a NumPy matrix on disk
+# (vectors-<version>.npy, rows L2-normalized, plus chunks.json with the text
+# and the name of its vectors file). A question is answered from the top-k
+# chunks by cosine similarity instead of the whole document.
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+class HashingEmbedder:
+    # Dependency-free default: hashed unigrams and bigrams with sublinear tf
+    def __init__(self, dim=1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _TOKEN_RE.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for feature in features:
+                vectors[row, zlib.crc32(feature.encode()) % self.dim] += 1.0
+        np.log1p(vectors, out=vectors)
+        return _normalize(vectors)
+
+
+class OllamaEmbedder:
+    # Embeddings from a local Ollama embedding model, e.g. nomic-embed-text.
+    # client is an ollama.Client, normally LLMClient's, so embeddings use the
+    # configured host, connection pool and timeouts.
+    def __init__(self, model, client=None):
+        self.model = model
+        self.client = client
+        self.name = f"ollama-{model}"
+
+    def embed(self, texts):
+        if self.client is None:
+            import ollama
+            self.client = ollama.Client()
+        response = self.client.embed(model=self.model, input=list(texts))
+        return _normalize(np.asarray(response['embeddings'], dtype=np.float32))
+
+
+def make_embedder(spec, client=None):
+    # 'hashing', 'hashing:2048' or 'ollama:<model>'
+    kind, _, arg = spec.partition(':')
+    if kind == 'hashing':
+        return HashingEmbedder(int(arg) if arg else 1024)
+    if kind == 'ollama':
+        return OllamaEmbedder(arg or 'nomic-embed-text', client)
+    raise ValueError(f"Unknown embedder: {spec}")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def chunk_text(text, chunk_tokens=200, overlap_tokens=40):
+    # Packs paragraphs (then sentences, then hard cuts) into chunks of about
+    # chunk_tokens, each starting with the tail of the previous one
+    limit = chunk_tokens * CHARS_PER_TOKEN
+    overlap = overlap_tokens * CHARS_PER_TOKEN
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph:
+            continue
+        if len(paragraph) <= limit:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE_RE.split(paragraph):
+            pieces.extend(sentence[start:start + limit] for start in range(0, len(sentence), limit))
+
+    chunks = []
+    current = ''
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > limit:
+            chunks.append(current)
+            current = current[-overlap:] if overlap else ''
+        current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class RetrievalIndex:
+    MAX_CACHED_USERS = 256
+
+    def __init__(self, root_dir, embedder, chunk_tokens=200, overlap_tokens=40, logger=None):
+        self.root_dir = root_dir
+        self.embedder = embedder
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.logger = logger
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._loaded = OrderedDict()  # user_id -> (file identity, vectors, meta), most recent last
+        self._loaded_lock = threading.Lock()
+
+    def _dir(self, user_id):
+        return os.path.join(self.root_dir, str(user_id))
+
+    def _lock(self, user_id):
+        with self._locks_lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def _load(self, user_id):
+        directory = self._dir(user_id)
+        meta_path = os.path.join(directory, 'chunks.json')
+        if not os.path.exists(meta_path):
+            return None, {'embedder': self.embedder.name, 'documents': {}, 'chunks': []}
+        with open(meta_path) as f:
+            # os.replace gives every write a new inode
+            stat = os.fstat(f.fileno())
+            identity = (stat.st_ino, stat.st_mtime_ns)
+            with self._loaded_lock:
+                cached = self._loaded.get(user_id)
+                if cached and cached[0] == identity:
+                    self._loaded.move_to_end(user_id)
+                    return cached[1], cached[2]
+            meta = json.load(f)
+        if meta['embedder'] != self.embedder.name:
+            # Embedder changed: old vectors live in a different space
+            if self.logger:
+                self.logger.info(f"Discarding retrieval index of user {user_id} built with {meta['embedder']}")
+            return None, {'embedder': self.embedder.name, 'documents': {}, 'chunks': []}
+        # chunks.json names its own vectors file, so the two always match
+        vectors = np.load(os.path.join(directory, meta.get('vectors', 'vectors.npy')), mmap_mode='r')
+        if len(vectors) != len(meta['chunks']):
+            raise ValueError(f"Retrieval index of user {user_id} is inconsistent "
+                             f"({len(vectors)} vectors, {len(meta['chunks'])} chunks)")
+        with self._loaded_lock:
+            self._loaded[user_id] = (identity, vectors, meta)
+            self._loaded.move_to_end(user_id)
+            while len(self._loaded) > self.MAX_CACHED_USERS:
+                self._loaded.popitem(last=False)
+        return vectors, meta
+
+    def add_document(self, user_id, file_name, text):
+        doc_id = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock(user_id):
+            vectors, meta = self._load(user_id)
+            if doc_id in meta['documents']:
+                return doc_id, 0
+            chunks = chunk_text(text, self.chunk_tokens, self.overlap_tokens)
+            if not chunks:
+                return doc_id, 0
+            new_vectors = self.embedder.embed(chunks)
+            combined = new_vectors if vectors is None else np.concatenate([np.asarray(vectors), new_vectors])
+            meta['documents'][doc_id] = {'file_name': file_name, 'chunks': len(chunks)}
+            meta['chunks'].extend({'doc': doc_id, 'file_name': file_name, 'index': i, 'text': chunk}
+                                  for i, chunk in enumerate(chunks))
+
+            directory = self._dir(user_id)
+            os.makedirs(directory, exist_ok=True)
+            # A new vectors file first, then the metadata that points at it;
+            # replacing chunks.json switches both at once for every reader
+            previous = meta.get('vectors', 'vectors.npy')
+            meta['version'] = meta.get('version', 0) + 1
+            meta['vectors'] = f"vectors-{meta['version']}.npy"
+            with open(os.path.join(directory, meta['vectors'] + '.tmp'), 'wb') as f:
+                np.save(f, combined.astype(np.float32))
+            os.replace(os.path.join(directory, meta['vectors'] + '.tmp'), os.path.join(directory, meta['vectors']))
+            with open(os.path.join(directory, 'chunks.json.tmp'), 'w') as f:
+                json.dump(meta, f)
+            os.replace(os.path.join(directory, 'chunks.json.tmp'), os.path.join(directory, 'chunks.json'))
+            # Keep the previous file for readers that just loaded the old
+            # chunks.json; anything older is unreferenced
+            for name in os.listdir(directory):
+                if name.startswith('vectors') and name.endswith('.npy') and name not in (meta['vectors'], previous):
+                    os.remove(os.path.join(directory, name))
+            with self._loaded_lock:
+                self._loaded.pop(user_id, None)
+        if self.logger:
+            self.logger.info(f"Indexed {len(chunks)} chunks of {file_name} for user {user_id}")
+        return doc_id, len(chunks)
+
+    def document_chunks(self, user_id, doc_id, limit):
+        _, meta = self._load(user_id)
+        return [chunk for chunk in meta['chunks'] if chunk['doc'] == doc_id][:limit]
+
+    def search(self, user_id, query, top_k=4, min_score=0.0, doc_id=None):
+        vectors, meta = self._load(user_id)
+        if vectors is None or not len(vectors):
+            return []
+        scores = np.asarray(vectors) @ self.embedder.embed([query])[0]
+        if doc_id is not None:
+            in_doc = np.array([chunk['doc'] == doc_id for chunk in meta['chunks']])
+            scores = np.where(in_doc, scores, -np.inf)
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [{**meta['chunks'][i], 'score': float(scores[i])} for i in best if scores[i] >= min_score]
+
+
+def format_excerpts(chunks):
+    return '\n\n'.join(f"[{chunk['file_name']}, part {chunk['index'] + 1}]\n{chunk['text']}" for chunk in chunks)
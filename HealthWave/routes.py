@@ -1,16 +1,33 @@
+import json
+from contextlib import closing
 from datetime import datetime
-from flask import render_template, flash, redirect, url_for, request, jsonify, session
+from sqlalchemy import insert
+from flask import render_template, flash, redirect, url_for, request, jsonify, session, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from extensions import db
 from services import cancer_service, chatbot_service
+from llm_client import LLMBusy
+from jobs import analysis_jobs
 from models import User, Appointment, MedicalRecord, AIAnalysis
-from forms import LoginForm, RegistrationForm, AppointmentForm, AIAnalysisForm, ChatbotForm
+from forms import LoginForm, RegistrationForm, AppointmentForm, AIAnalysisForm, AIBatchAnalysisForm, ChatbotForm
 from app import app
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/health/ready')
+def readiness():
+    status = cancer_service.readiness()
+    ready = cancer_service.is_ready()
+    cache = chatbot_service.response_cache
+    return jsonify({
+        'ready': ready,
+        'models': status,
+        'llm': chatbot_service.llm.stats(),
+        'chat_cache': cache.stats() if cache else None
+    }), 200 if ready else 503
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -82,7 +99,7 @@ def doctor_dashboard():
     
     recent_appointments = Appointment.query.filter_by(doctor_id=current_user.id).order_by(Appointment.appointment_date.desc()).limit(5).all()
     
-    recent_analyses = AIAnalysis.query.filter_by(analyzed_by=current_user.id).order_by(AIAnalysis.analyzed_at.desc()).limit(5).all()
+    recent_analyses = AIAnalysis.query.filter_by(analyzed_by=current_user.id, status='done').order_by(AIAnalysis.analyzed_at.desc()).limit(5).all()
     
     return render_template('doctor/dashboard.html', 
                          recent_appointments=recent_appointments,
@@ -96,8 +113,8 @@ def ai_analysis():
         return redirect(url_for('index'))
     
     form = AIAnalysisForm()
-    form.patient_id.choices = [(p.id, f"{p.get_full_name()} ({p.username})") 
-                             for p in User.query.filter_by(role='patient').all()]
+    batch_form = AIBatchAnalysisForm()
+    form.patient_id.choices = batch_form.patient_id.choices = _patient_choices()
     
     if form.validate_on_submit():
         try:
@@ -119,10 +136,104 @@ def ai_analysis():
             flash(f'Analysis error: {str(e)}', 'error')
             app.logger.error(f"Cancer analysis failed: {str(e)}")
 
-    analyses = AIAnalysis.query.filter_by(analyzed_by=current_user.id)\
+    analyses = AIAnalysis.query.filter_by(analyzed_by=current_user.id, status='done')\
                              .order_by(AIAnalysis.analyzed_at.desc())\
                              .limit(10).all()
-    return render_template('doctor/ai_analysis.html', form=form, analyses=analyses)
+    return render_template('doctor/ai_analysis.html', form=form, batch_form=batch_form, analyses=analyses)
+
+@app.route('/doctor/ai-analysis/batch', methods=['POST'])
+@login_required
+def ai_analysis_batch():
+    if not current_user.is_doctor():
+        flash('Access denied. Doctor privileges required.', 'error')
+        return redirect(url_for('index'))
+    
+    form = AIBatchAnalysisForm()
+    form.patient_id.choices = _patient_choices()
+    
+    if form.validate_on_submit():
+        try:
+            analyses_data = cancer_service.analyze_images(
+                form.image_files.data,
+                form.patient_id.data,
+                current_user.id
+            )
+            if not analyses_data:
+                flash('No images found in the upload.', 'warning')
+                return redirect(url_for('ai_analysis'))
+            
+            # One executemany for the whole study instead of a commit per image
+            db.session.execute(insert(AIAnalysis), analyses_data)
+            db.session.commit()
+            
+            flash(f'{len(analyses_data)} images analyzed!', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Analysis error: {str(e)}', 'error')
+            app.logger.error(f"Batch cancer analysis failed: {str(e)}")
+    else:
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'error')
+    
+    return redirect(url_for('ai_analysis'))
+
+@app.route('/api/ai-analysis/jobs', methods=['POST'])
+@login_required
+def submit_analysis_job():
+    if not current_user.is_doctor():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    image_file = request.files.get('image_file')
+    patient_id = request.form.get('patient_id', type=int)
+    if not image_file or not image_file.filename:
+        return jsonify({'error': 'No image provided'}), 400
+    if not patient_id or not User.query.filter_by(id=patient_id, role='patient').first():
+        return jsonify({'error': 'Unknown patient'}), 400
+    
+    try:
+        analysis = analysis_jobs.submit(image_file, patient_id, current_user.id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Failed to queue analysis job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({
+        'job_id': analysis.id,
+        'status': analysis.status,
+        'status_url': url_for('analysis_job_status', job_id=analysis.id)
+    }), 202
+
+@app.route('/api/ai-analysis/jobs/<int:job_id>')
+@login_required
+def analysis_job_status(job_id):
+    if not current_user.is_doctor():
+        return jsonify({'error': 'Access denied'}), 403
+    
+    analysis = AIAnalysis.query.filter_by(id=job_id, analyzed_by=current_user.id).first()
+    if analysis is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    response = {'job_id': analysis.id, 'status': analysis.status}
+    if analysis.status == 'done':
+        response.update({
+            'analysis_type': analysis.analysis_type,
+            'result': analysis.result,
+            'confidence_score': analysis.confidence_score,
+            'risk_level': analysis.risk_level,
+            'recommendations': analysis.recommendations,
+            'image_type': analysis.image_type,
+            'analyzed_at': analysis.analyzed_at.isoformat()
+        })
+    elif analysis.status == 'failed':
+        response['error'] = analysis.error
+    return jsonify(response)
+
+def _patient_choices():
+    return [(p.id, f"{p.get_full_name()} ({p.username})") 
+            for p in User.query.filter_by(role='patient').all()]
 
 @app.route('/doctor/chatbot', methods=['GET'])
 @login_required
@@ -148,6 +259,7 @@ def chatbot_api():
         if not message and not file:
             return jsonify({'error': 'No message or file provided'}), 400
         
+        chatbot_service.llm.admit(current_user.id)
         response = chatbot_service.get_response(
             user_message=message,
             user_id=current_user.id,
@@ -158,9 +270,71 @@ def chatbot_api():
         
         return jsonify({'response': response})
     
+    except LLMBusy as e:
+        return _busy_response(e)
     except Exception as e:
         app.logger.error(f"Error in chatbot route: {str(e)}")
         return jsonify({'error': str(e)}), 500
+
+def _busy_response(e):
+    return jsonify({
+        'error': f"The assistant is busy, please try again in {e.retry_after} seconds.",
+        'retry_after': e.retry_after
+    }), 503, {'Retry-After': str(e.retry_after)}
+
+@app.route('/api/chatbot/stream', methods=['POST'])
+@login_required
+def chatbot_stream():
+    if not current_user.is_doctor():
+        return jsonify({'error': 'Access denied'}), 403
+
+    message = request.form.get('message')
+    file = request.files.get('file')
+    if not message and not file:
+        return jsonify({'error': 'No message or file provided'}), 400
+
+    # Refuse before reading the upload when the queue is already full
+    try:
+        chatbot_service.llm.admit(current_user.id)
+    except LLMBusy as e:
+        return _busy_response(e)
+
+    # The upload has to be read before the response starts streaming
+    try:
+        messages, cache_key, turn, error = chatbot_service.build_messages(
+            user_message=message,
+            user_id=current_user.id,
+            role='user',
+            is_file=file is not None,
+            file_name=file
+        )
+    except LLMBusy as e:
+        # The summarizer couldn't get a slot
+        return _busy_response(e)
+    except Exception as e:
+        app.logger.error(f"Error in chatbot stream: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    if error:
+        return jsonify({'error': error}), 400
+    user_id = current_user.id
+
+    def events():
+        try:
+            with closing(chatbot_service.stream_reply(messages, user_id, turn, cache_key)) as tokens:
+                for token in tokens:
+                    yield f"data: {json.dumps({'token': token})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except LLMBusy as e:
+            # Waited in the queue too long; headers are already sent
+            payload = {'error': f"The assistant is busy, please try again in {e.retry_after} seconds.",
+                       'retry_after': e.retry_after}
+            yield f"event: error\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            app.logger.error(f"Error in chatbot stream: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
     
 @app.route('/doctor/3d-viewer')
 @login_required
@@ -216,7 +390,7 @@ def patient_history():
         MedicalRecord.date_recorded.desc()
     ).all()
     
-    ai_analyses = AIAnalysis.query.filter_by(patient_id=current_user.id).order_by(
+    ai_analyses = AIAnalysis.query.filter_by(patient_id=current_user.id, status='done').order_by(
         AIAnalysis.analyzed_at.desc()
     ).all()
     
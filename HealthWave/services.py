@@ -1,14 +1,134 @@
-from tensorflow.keras.models import load_model
 import numpy as np
 from PIL import Image
-import fitz 
 import os
 import io
-from models import ChatConversation
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from sqlalchemy import exc
+from models import ChatConversation, PredictionCacheEntry
+from chatbot import ContextBuilder, ResponseCache
+from retrieval import RetrievalIndex, make_embedder, format_excerpts
+from pdf_text import PDFTextExtractor
+from llm_client import LLMClient, LLMBusy
+from inference_backends import InferenceBatcher, file_fingerprint, load_backend, model_filename
+from inference_server import RemoteInferenceClient, RemoteModel
 from extensions import db
 from werkzeug.utils import secure_filename
 import requests as rq
-import ollama
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+DICOM_EXTENSIONS = ('.dcm',)
+MODEL_INPUT_SIZE = (128, 128)
+MODEL_TYPES = ('lung', 'brain')
+CHAT_MODEL = "monotykamary/medichat-llama3:8b"
+CHAT_SYSTEM_PROMPT = 'You are a helpful medical assistant.'
+
+
+class PredictionCache:
+    # Content-addressed cache of raw model outputs. Keys hash the preprocessed
+    # pixels together with the model file fingerprint, so replacing a model
+    # file makes all of its old entries unreachable.
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, persist=True, logger=None):
+        self.max_bytes = max_bytes
+        self.persist = persist
+        self.logger = logger
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(img_array, fingerprint):
+        digest = hashlib.sha256(fingerprint.encode('ascii'))
+        digest.update(np.ascontiguousarray(img_array).data)
+        return digest.hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+
+        remaining = [key for key in set(keys) if key not in found]
+        if remaining and self.persist:
+            try:
+                rows = PredictionCacheEntry.query.filter(PredictionCacheEntry.cache_key.in_(remaining)).all()
+            except exc.SQLAlchemyError as e:
+                db.session.rollback()
+                self._log_error(f"Prediction cache lookup failed: {str(e)}")
+                rows = []
+            for row in rows:
+                prediction = np.asarray(json.loads(row.prediction), dtype=np.float32)
+                self._remember(row.cache_key, row.model_fingerprint, prediction)
+                found[row.cache_key] = prediction
+        return found
+
+    def put_many(self, predictions, image_type, fingerprint):
+        for key, prediction in predictions.items():
+            self._remember(key, fingerprint, prediction)
+
+        if not self.persist:
+            return
+        try:
+            db.session.add_all([
+                PredictionCacheEntry(
+                    cache_key=key,
+                    image_type=image_type,
+                    model_fingerprint=fingerprint,
+                    prediction=json.dumps(np.asarray(prediction).tolist())
+                )
+                for key, prediction in predictions.items()
+            ])
+            db.session.commit()
+        except exc.SQLAlchemyError as e:
+            # Most likely another worker stored the same key first
+            db.session.rollback()
+            self._log_error(f"Prediction cache write failed: {str(e)}")
+
+    def invalidate(self, fingerprint):
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[0] == fingerprint]
+            for key in stale:
+                self._size -= self._entry_size(key, self._entries.pop(key)[1])
+
+        if not self.persist:
+            return
+        try:
+            PredictionCacheEntry.query.filter_by(model_fingerprint=fingerprint).delete()
+            db.session.commit()
+        except exc.SQLAlchemyError as e:
+            db.session.rollback()
+            self._log_error(f"Prediction cache invalidation failed: {str(e)}")
+
+    def _remember(self, key, fingerprint, prediction):
+        prediction = np.array(prediction, dtype=np.float32)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (fingerprint, prediction)
+            self._size += self._entry_size(key, prediction)
+            while self._size > self.max_bytes and self._entries:
+                old_key, (_, old_prediction) = self._entries.popitem(last=False)
+                self._size -= self._entry_size(old_key, old_prediction)
+
+    def _entry_size(self, key, prediction):
+        return len(key) + prediction.nbytes + self.ENTRY_OVERHEAD
+
+    def _log_error(self, message):
+        if self.logger is not None:
+            self.logger.error(message)
+
 
 class CancerAnalysisService:
     def __init__(self, app=None):
@@ -16,56 +136,422 @@ class CancerAnalysisService:
         self.lung_model = None
         self.brain_model = None
         self.uploads_dir = None
+        self.batchers = {}
+        self.max_batch_size = 16
+        self.max_wait_ms = 5
+        self.model_dir = None
+        self.backend = 'keras'
+        self.inference_threads = None
+        self.inference_client = None
+        self.fingerprints = {}
+        self.model_stats = {}
+        self.reload_check_interval = 5
+        self._last_reload_check = {}
+        self._model_lock = threading.Lock()
+        self._hot = {image_type: False for image_type in MODEL_TYPES}
+        self._cold_fingerprints = {}
+        self.warmup = False
+        self.cache = None
         
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app):
+        self.app = app
         self.uploads_dir = os.path.join(app.instance_path, 'uploads')
         os.makedirs(self.uploads_dir, exist_ok=True)
 
-        model_dir = app.config.get('MODEL_DIR', 'models')
-        self.lung_model = load_model(os.path.join(model_dir, 'lung_model.h5'))
-        self.brain_model = load_model(os.path.join(model_dir, 'brain_model.h5'))
-        app.logger.info(f"Lung model input shape: {self.lung_model.input_shape}")
-        app.logger.info(f"Brain model input shape: {self.brain_model.input_shape}")
+        self.model_dir = app.config.get('MODEL_DIR', 'models')
+        self.backend = app.config.get('INFERENCE_BACKEND', 'keras')
+        self.inference_threads = app.config.get('INFERENCE_THREADS')
+        server_socket = app.config.get('INFERENCE_SERVER_SOCKET')
+        if server_socket:
+            # Thin client mode: models live in the shared inference_server.py process
+            authkey = app.config.get('INFERENCE_SERVER_AUTHKEY')
+            if not authkey:
+                raise RuntimeError('INFERENCE_SERVER_SOCKET requires INFERENCE_SERVER_AUTHKEY')
+            self.inference_client = RemoteInferenceClient(server_socket, authkey=authkey.encode())
+        self.max_batch_size = app.config.get('INFERENCE_MAX_BATCH_SIZE', 16)
+        self.max_wait_ms = app.config.get('INFERENCE_BATCH_WAIT_MS', 5)
+        self.reload_check_interval = app.config.get('MODEL_RELOAD_CHECK_INTERVAL', 5)
+        self.cache = PredictionCache(
+            max_bytes=app.config.get('PREDICTION_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+            persist=app.config.get('PREDICTION_CACHE_PERSIST', True),
+            logger=app.logger
+        )
+        # Models (and TensorFlow itself) are loaded on first use so that CLI
+        # commands and non-inference routes don't pay for them
+        self.warmup = app.config.get('MODEL_WARMUP', False)
+        if self.warmup:
+            threading.Thread(target=self.warm_up, name='model-warmup', daemon=True).start()
+
+    def warm_up(self):
+        for image_type in MODEL_TYPES:
+            try:
+                self._ensure_model(image_type)
+                dummy = np.zeros(MODEL_INPUT_SIZE + (3,), dtype=np.float32)
+                self.batchers[image_type].predict(dummy)
+                self._hot[image_type] = True
+            except Exception as e:
+                self.app.logger.error(f"{image_type.title()} model warm-up failed: {str(e)}")
+        self.app.logger.info(f"Model warm-up finished: {self.readiness()}")
+
+    def readiness(self):
+        return {
+            image_type: 'hot' if self._hot[image_type]
+            else 'loaded' if image_type in self.model_stats
+            else 'cold'
+            for image_type in MODEL_TYPES
+        }
+
+    def is_ready(self):
+        # Without warm-up, models load on the first request by design
+        if not self.warmup:
+            return True
+        return all(self._hot.values())
+
+    def _ensure_model(self, image_type):
+        if image_type in self.model_stats:
+            return
+        with self._model_lock:
+            if image_type not in self.model_stats:
+                self._load_model(image_type)
+
+    def _model_path(self, image_type):
+        return os.path.join(self.model_dir, model_filename(image_type, self.backend))
+
+    def _model_version(self, image_type):
+        # Remote models are versioned by the server's fingerprint, local ones
+        # by a cheap stat() of the model file
+        if self.inference_client is not None:
+            return self.inference_client.info()[image_type]['fingerprint']
+        stat = os.stat(self._model_path(image_type))
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load_model(self, image_type):
+        version = self._model_version(image_type)
+        max_wait_ms = self.max_wait_ms
+        if self.inference_client is not None:
+            model = RemoteModel(self.inference_client, image_type)
+            self.fingerprints[image_type] = version
+            # The server batches across workers; only coalesce what is already queued here
+            max_wait_ms = 0
+        else:
+            path = self._model_path(image_type)
+            model = load_backend(self.backend, path, num_threads=self.inference_threads)
+            self.fingerprints[image_type] = file_fingerprint(path)
+        setattr(self, f"{image_type}_model", model)
+
+        old_batcher = self.batchers.get(image_type)
+        self.batchers[image_type] = InferenceBatcher(
+            model.predict,
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name=f"{image_type}-batcher"
+        )
+        if old_batcher is not None:
+            old_batcher.close()
+        # Set last: _ensure_model treats model_stats as the "loaded" flag
+        self.model_stats[image_type] = version
+        if self.inference_client is None:
+            self.app.logger.info(f"{image_type.title()} model ({self.backend}) input shape: {model.input_shape}")
+
+    def _refresh_model(self, image_type):
+        # Version check at most every reload_check_interval seconds; a replaced
+        # model file is reloaded and its cached predictions dropped.
+        now = time.monotonic()
+        if now - self._last_reload_check.get(image_type, 0) < self.reload_check_interval:
+            return
+        self._last_reload_check[image_type] = now
+        try:
+            version = self._model_version(image_type)
+        except (OSError, EOFError, RuntimeError):
+            return
+        if version == self.model_stats[image_type]:
+            return
 
+        with self._model_lock:
+            if version == self.model_stats[image_type]:
+                return
+            old_fingerprint = self.fingerprints[image_type]
+            self._hot[image_type] = False
+            self._load_model(image_type)
+            if self.fingerprints[image_type] != old_fingerprint:
+                self.app.logger.info(f"{image_type.title()} model changed, invalidating cached predictions")
+                self.cache.invalidate(old_fingerprint)
 
     def analyze_image(self, image_file, patient_id, doctor_id):
-        temp_path = None
+        filename = secure_filename(image_file.filename)
+        if filename.lower().endswith(DICOM_EXTENSIONS):
+            return self.analyze_dicom_series([image_file], patient_id, doctor_id)['series']
+        
+        # Decode straight from the upload stream, no temp file round trip
+        img = self._open_image(image_file.stream)
+        image_type = self._detect_image_type(img, filename)
         
+        result = self._analyze_with_model(img, image_type)
+        
+        return self._build_analysis(result, image_type, filename, patient_id, doctor_id)
+
+    def analyze_images(self, image_files, patient_id, doctor_id):
+        # Bulk path: every image of a study is decoded into one stacked tensor
+        # per model and scored with a single batched inference per model.
+        # DICOM files in the upload are treated as one series.
+        grouped = {'lung': [], 'brain': []}
+        dicom_paths = []
         try:
+            for filename, img in self._iter_uploaded_images(image_files, dicom_paths):
+                image_type = self._detect_image_type(img, filename)
+                grouped[image_type].append((filename, np.asarray(self._resize_image(img), dtype=np.uint8)))
+
+            analyses = []
+            for image_type, items in grouped.items():
+                if not items:
+                    continue
+                batch = self._preprocess_batch([pixels for _, pixels in items])
+                predictions = self._predict_batch(batch, image_type)
+                for i, (filename, _) in enumerate(items):
+                    result = self._interpret_prediction(predictions[i:i + 1], image_type)
+                    analyses.append(self._build_analysis(result, image_type, filename, patient_id, doctor_id))
+
+            if dicom_paths:
+                series = self._analyze_dicom_paths(dicom_paths, patient_id, doctor_id)
+                analyses.extend(series['slices'])
+                analyses.append(series['series'])
+            return analyses
+        finally:
+            self._remove_spooled(dicom_paths)
+
+    def analyze_dicom_series(self, dicom_files, patient_id, doctor_id):
+        paths = []
+        try:
+            for dicom_file in dicom_files:
+                paths.append((secure_filename(dicom_file.filename), self._spool_upload(dicom_file.stream)))
+            return self._analyze_dicom_paths(paths, patient_id, doctor_id)
+        finally:
+            self._remove_spooled(paths)
+
+    def _iter_uploaded_images(self, image_files, dicom_paths):
+        for image_file in image_files:
+            if not image_file or not image_file.filename:
+                continue
             filename = secure_filename(image_file.filename)
-            temp_path = os.path.join(self.uploads_dir, filename)
-            image_file.save(temp_path)
-            
-            # Process the image
-            img = Image.open(temp_path)
-            image_type = self._detect_image_type(img, filename)
-            
-            result = self._analyze_with_model(img, image_type)
-            
-            # Clean up
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
-            
-            return {
-                'patient_id': patient_id,
-                'analysis_type': f"{image_type.title()} Cancer Detection",
-                'result': result['result'],
-                'confidence_score': result['confidence'],
-                'risk_level': result['risk_level'],
-                'recommendations': result['recommendations'],
-                'image_filename': filename,
-                'image_type': image_type,
-                'analyzed_by': doctor_id
-            }
-            
-        except Exception as e:
-            # Clean up if error occurs
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
-            raise e
+            if filename.lower().endswith('.zip'):
+                with zipfile.ZipFile(image_file.stream) as archive:
+                    for member in archive.infolist():
+                        member_name = secure_filename(os.path.basename(member.filename))
+                        if member.is_dir():
+                            continue
+                        if member_name.lower().endswith(DICOM_EXTENSIONS):
+                            with archive.open(member) as fh:
+                                dicom_paths.append((member_name, self._spool_upload(fh)))
+                        elif member_name.lower().endswith(IMAGE_EXTENSIONS):
+                            with archive.open(member) as fh:
+                                img = self._open_image(io.BytesIO(fh.read()))
+                            yield member_name, img
+            elif filename.lower().endswith(DICOM_EXTENSIONS):
+                dicom_paths.append((filename, self._spool_upload(image_file.stream)))
+            elif filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield filename, self._open_image(image_file.stream)
+            else:
+                raise ValueError(f"Unsupported file type: {filename}")
+
+    def _spool_upload(self, stream):
+        # DICOM pixel data is memory-mapped, which needs a real file
+        with tempfile.NamedTemporaryFile(dir=self.uploads_dir, suffix='.dcm', delete=False) as f:
+            shutil.copyfileobj(stream, f)
+            return f.name
+
+    def _remove_spooled(self, paths):
+        for _, path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _analyze_dicom_paths(self, paths, patient_id, doctor_id):
+        import pydicom
+
+        # Headers only: pixel data stays on disk until it is memory-mapped
+        headers = [(name, path, pydicom.dcmread(path, defer_size=1024)) for name, path in paths]
+        headers.sort(key=lambda header: self._slice_position(header[2]))
+        image_type = self._detect_dicom_type(headers)
+
+        volume, names = self._load_dicom_volume(headers)
+        batch = np.repeat(volume[..., np.newaxis], 3, axis=-1)
+        predictions = self._predict_batch(batch, image_type)
+
+        slices = [
+            self._build_analysis(
+                self._interpret_prediction(predictions[i:i + 1], image_type),
+                image_type, name, patient_id, doctor_id
+            )
+            for i, name in enumerate(names)
+        ]
+
+        # The series is as suspicious as its most suspicious slice
+        confidences = predictions[:, 0]
+        peak = int(confidences.argmax())
+        flagged = sum(1 for analysis in slices if analysis['risk_level'] != 'low')
+        result = self._interpret_prediction(predictions[peak:peak + 1], image_type)
+        result['result'] = (f"{result['result']} (series of {len(names)} slices, "
+                            f"{flagged} flagged, peak at slice {peak + 1})")
+        series_name = names[0] if len(names) == 1 else f"{names[0]} (+{len(names) - 1} slices)"
+        series = self._build_analysis(result, image_type, series_name, patient_id, doctor_id)
+        series['analysis_type'] = f"{image_type.title()} Cancer Detection (Series)"
+
+        return {
+            'series': series,
+            'slices': slices,
+            'mean_confidence': float(confidences.mean()),
+            'peak_slice': peak
+        }
+
+    def _slice_position(self, ds):
+        position = ds.get('ImagePositionPatient')
+        if position is not None and len(position) == 3:
+            return float(position[2])
+        return float(ds.get('InstanceNumber', 0) or 0)
+
+    def _detect_dicom_type(self, headers):
+        name, _, ds = headers[0]
+        try:
+            return self._detect_image_type(None, name)
+        except ValueError:
+            pass
+        description = ' '.join(str(ds.get(keyword, '')) for keyword in
+                               ('BodyPartExamined', 'StudyDescription', 'SeriesDescription')).lower()
+        if any(word in description for word in ('lung', 'chest', 'thorax')):
+            return 'lung'
+        if any(word in description for word in ('brain', 'head')) or ds.get('Modality') == 'MR':
+            return 'brain'
+        raise ValueError("Could not determine image type")
+
+    def _load_dicom_volume(self, headers):
+        height, width = MODEL_INPUT_SIZE
+        counts = [int(ds.get('NumberOfFrames', 1) or 1) for _, _, ds in headers]
+        volume = np.empty((sum(counts), height, width), dtype=np.float32)
+        slope = np.empty(len(volume), dtype=np.float32)
+        intercept = np.empty(len(volume), dtype=np.float32)
+        center = np.full(len(volume), np.nan, dtype=np.float32)
+        window = np.full(len(volume), np.nan, dtype=np.float32)
+        invert = np.zeros(len(volume), dtype=bool)
+        names = []
+
+        start = 0
+        for (name, path, ds), count in zip(headers, counts):
+            pixels = self._map_dicom_pixels(path, ds, count)
+            # Nearest-neighbour gather of the model grid straight from the
+            # mapped pixels: only the sampled rows are ever read
+            rows = (np.arange(height) * pixels.shape[1]) // height
+            cols = (np.arange(width) * pixels.shape[2]) // width
+            volume[start:start + count] = pixels[:, rows[:, np.newaxis], cols]
+            del pixels
+
+            slope[start:start + count] = float(ds.get('RescaleSlope', 1) or 1)
+            intercept[start:start + count] = float(ds.get('RescaleIntercept', 0) or 0)
+            if ds.get('WindowCenter') is not None and ds.get('WindowWidth') is not None:
+                center[start:start + count] = self._first_value(ds.WindowCenter)
+                window[start:start + count] = self._first_value(ds.WindowWidth)
+            invert[start:start + count] = ds.get('PhotometricInterpretation') == 'MONOCHROME1'
+            names.extend([name] if count == 1 else [f"{name}#{i + 1}" for i in range(count)])
+            start += count
+
+        # Modality LUT and VOI windowing for the whole series at once
+        volume *= slope[:, np.newaxis, np.newaxis]
+        volume += intercept[:, np.newaxis, np.newaxis]
+        missing = np.isnan(center) | np.isnan(window) | (window <= 0)
+        if missing.any():
+            low = volume[missing].min(axis=(1, 2))
+            high = volume[missing].max(axis=(1, 2))
+            center[missing] = (low + high) / 2
+            window[missing] = np.maximum(high - low, 1)
+        lower = (center - window / 2)[:, np.newaxis, np.newaxis]
+        volume -= lower
+        volume /= window[:, np.newaxis, np.newaxis]
+        np.clip(volume, 0.0, 1.0, out=volume)
+        volume[invert] = 1.0 - volume[invert]
+        return volume, names
+
+    def _map_dicom_pixels(self, path, ds, frames):
+        syntax = ds.file_meta.TransferSyntaxUID
+        # keep_deferred: look up where the value starts without reading it
+        element = ds.get_item('PixelData', keep_deferred=True)
+        bits = int(ds.get('BitsAllocated', 0))
+        if (syntax.is_compressed or element is None or getattr(element, 'value_tell', None) is None
+                or int(ds.get('SamplesPerPixel', 1)) != 1 or bits not in (8, 16, 32)):
+            # Encapsulated or colour data has to go through the decoder
+            pixels = np.asarray(ds.pixel_array, dtype=np.float32)
+            if int(ds.get('SamplesPerPixel', 1)) != 1:
+                pixels = pixels.mean(axis=-1)
+            return pixels.reshape((frames, int(ds.Rows), int(ds.Columns)))
+
+        dtype = np.dtype(f"{'<' if syntax.is_little_endian else '>'}"
+                         f"{'i' if int(ds.get('PixelRepresentation', 0)) else 'u'}{bits // 8}")
+        return np.memmap(path, dtype=dtype, mode='r', offset=element.value_tell,
+                         shape=(frames, int(ds.Rows), int(ds.Columns)))
+
+    @staticmethod
+    def _first_value(value):
+        # Window attributes may be multi-valued; the first pair is the default
+        if isinstance(value, (int, float, str)):
+            return float(value)
+        return float(value[0])
+
+    def _model_fingerprint(self, image_type):
+        # The cache key only needs the model's fingerprint, so a cold worker
+        # can serve cache hits without importing TensorFlow
+        if image_type in self.model_stats:
+            self._refresh_model(image_type)
+            return self.fingerprints[image_type]
+        version = self._model_version(image_type)
+        known = self._cold_fingerprints.get(image_type)
+        if known is None or known[0] != version:
+            if self.inference_client is not None:
+                fingerprint = version
+            else:
+                fingerprint = file_fingerprint(self._model_path(image_type))
+            known = self._cold_fingerprints[image_type] = (version, fingerprint)
+        return known[1]
+
+    def _predict_batch(self, batch, image_type):
+        fingerprint = self._model_fingerprint(image_type)
+        keys = [self.cache.make_key(img_array, fingerprint) for img_array in batch]
+        predictions = self.cache.get_many(keys)
+
+        missing = [i for i, key in enumerate(keys) if key not in predictions]
+        if missing:
+            self._ensure_model(image_type)
+            if self.fingerprints[image_type] != fingerprint:
+                # Model file replaced between the lookup and the load
+                return self._predict_batch(batch, image_type)
+            if len(missing) == 1:
+                # Single images go through the batcher to coalesce with other requests
+                fresh = self.batchers[image_type].predict(batch[missing[0]])
+            else:
+                model = self.lung_model if image_type == 'lung' else self.brain_model
+                pending = batch[missing]
+                fresh = np.concatenate([
+                    model.predict(pending[start:start + self.max_batch_size])
+                    for start in range(0, len(pending), self.max_batch_size)
+                ])
+            self._hot[image_type] = True
+            computed = {keys[i]: fresh[j] for j, i in enumerate(missing)}
+            self.cache.put_many(computed, image_type, fingerprint)
+            predictions.update(computed)
+
+        return np.stack([predictions[key] for key in keys])
+
+    def _build_analysis(self, result, image_type, filename, patient_id, doctor_id):
+        return {
+            'patient_id': patient_id,
+            'analysis_type': f"{image_type.title()} Cancer Detection",
+            'result': result['result'],
+            'confidence_score': result['confidence'],
+            'risk_level': result['risk_level'],
+            'recommendations': result['recommendations'],
+            'image_filename': filename,
+            'image_type': image_type,
+            'analyzed_by': doctor_id
+        }
 
     def _detect_image_type(self, img, filename):
         filename_lower = filename.lower()
@@ -78,28 +564,38 @@ class CancerAnalysisService:
         raise ValueError("Could not determine image type")
 
     def _analyze_with_model(self, img, image_type):
-        model = self.lung_model if image_type == 'lung' else self.brain_model
         img_array = self._preprocess_image(img, image_type)
-        prediction = model.predict(np.expand_dims(img_array, axis=0))
+        prediction = self._predict_batch(img_array[np.newaxis], image_type)
         return self._interpret_prediction(prediction, image_type)
 
+    def _open_image(self, fp):
+        img = Image.open(fp)
+        # JPEGs can be downscaled by 1/2..1/8 inside the decoder, so large
+        # scans never get materialized at full resolution
+        if img.format == 'JPEG':
+            img.draft('RGB', MODEL_INPUT_SIZE)
+        return img
+
     def _preprocess_image(self, img, image_type):
+        # Single uint8 -> float32 conversion, normalized in place
+        img_array = np.asarray(self._resize_image(img), dtype=np.float32)
+        img_array *= 1.0 / 255.0
+        return img_array
+
+    def _resize_image(self, img):
         # Convert to RGB if grayscale (1 channel)
         if img.mode != 'RGB':
             img = img.convert('RGB')
         
-        # Resize based on model requirements
-        target_size = (128, 128)  # Adjust based on your model's expected input size
-        img = img.resize(target_size)
-        
-        # Convert to numpy array and normalize
-        img_array = np.array(img) / 255.0
-        
-        # Ensure proper shape (height, width, channels)
-        if len(img_array.shape) == 2:  # If grayscale somehow
-            img_array = np.stack((img_array,)*3, axis=-1)  # Convert to 3 channels
-        
-        return img_array
+        # Resize based on model requirements; reducing_gap lets PIL apply a
+        # cheap integer reduce() before the final resample
+        return img.resize(MODEL_INPUT_SIZE, reducing_gap=2.0)
+
+    def _preprocess_batch(self, pixel_arrays):
+        # Stack the uint8 images first so normalization is one vectorized pass
+        batch = np.stack(pixel_arrays).astype(np.float32)
+        batch *= 1.0 / 255.0
+        return batch
 
     def _interpret_prediction(self, prediction, image_type):
         confidence = float(prediction[0][0])
@@ -117,31 +613,106 @@ class CancerAnalysisService:
                      'medium' if confidence > 0.5 else
                      'low')
         
+        if risk_level == 'low':
+            recommendations = 'No immediate follow-up required. Continue routine screening.'
+        else:
+            recommendations = f"Refer the patient to a {specialist} for further evaluation."
+        
         return {
             'result': result,
             'confidence': confidence,
-            'risk_level': risk_level
+            'risk_level': risk_level,
+            'recommendations': recommendations
         }
 class ChatbotService:
-    def __init__(self):
+    def __init__(self, app=None):
         self.uploads_dir = os.path.join(os.path.dirname(__file__), 'uploads')
         os.makedirs(self.uploads_dir, exist_ok=True)
+        self.context = None
+        self.retrieval = None
+        self.response_cache = None
+        self.pdf_extractor = PDFTextExtractor()
+        self.llm = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.llm = LLMClient(
+            host=app.config.get('LLM_HOST'),
+            model=CHAT_MODEL,
+            max_concurrency=app.config.get('LLM_MAX_CONCURRENCY', 2),
+            max_queue=app.config.get('LLM_MAX_QUEUE', 32),
+            max_queue_per_user=app.config.get('LLM_MAX_QUEUE_PER_USER', 2),
+            queue_timeout=app.config.get('LLM_QUEUE_TIMEOUT', 30),
+            request_timeout=app.config.get('LLM_REQUEST_TIMEOUT', 120),
+            logger=app.logger
+        )
+        self.summary_tokens = app.config.get('CHAT_SUMMARY_TOKENS', 512)
+        self.pdf_extractor = PDFTextExtractor(
+            cache_dir=os.path.join(app.instance_path, 'pdf_text'),
+            workers=app.config.get('PDF_EXTRACT_WORKERS', 0),
+            parallel_min_pages=app.config.get('PDF_PARALLEL_MIN_PAGES', 16),
+            logger=app.logger
+        )
+        if app.config.get('CHAT_RETRIEVAL', True):
+            self.retrieval = RetrievalIndex(
+                os.path.join(app.instance_path, 'retrieval'),
+                make_embedder(app.config.get('CHAT_EMBEDDER', 'hashing'), self.llm.client),
+                chunk_tokens=app.config.get('CHAT_CHUNK_TOKENS', 200),
+                logger=app.logger
+            )
+        self.retrieval_top_k = app.config.get('CHAT_RETRIEVAL_TOP_K', 4)
+        self.retrieval_min_score = app.config.get('CHAT_RETRIEVAL_MIN_SCORE', 0.15)
+        self.context = ContextBuilder(
+            self._summarize,
+            token_budget=app.config.get('CHAT_CONTEXT_TOKENS', 3072),
+            summary_tokens=self.summary_tokens,
+            max_turn_tokens=app.config.get('CHAT_MAX_TURN_TOKENS', 1024),
+            include_file_content=self.retrieval is None,
+            app=app,
+            logger=app.logger
+        )
+        if app.config.get('CHAT_CACHE', True):
+            self.response_cache = ResponseCache(
+                self.llm.model,
+                max_entries=app.config.get('CHAT_CACHE_MAX_ENTRIES', 1024),
+                ttl=app.config.get('CHAT_CACHE_TTL', 86400),
+                min_words=app.config.get('CHAT_CACHE_MIN_WORDS', 4),
+                logger=app.logger
+            )
+
+    def _summarize(self, previous_summary, turns):
+        transcript = '\n'.join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        # All summaries share one queue lane, so they never crowd out doctors
+        reply = self.llm.chat(
+            'summarizer',
+            [
+                {'role': 'system', 'content': 'You maintain a concise running summary of a conversation between '
+                                              'a doctor and a medical assistant. Keep patient details, findings, '
+                                              'medications, doses and open questions; drop small talk.'},
+                {'role': 'user', 'content': f"Current summary:\n{previous_summary or '(none)'}\n\n"
+                                            f"New turns:\n{transcript}\n\n"
+                                            f"Reply with the updated summary only."},
+            ],
+            num_predict=self.summary_tokens
+        )
+        return reply.strip()
 
     def extract_file(self, file):
+        # Returns the saved path and the raw bytes, so the upload is read once
         if file and file.filename:
             filename = secure_filename(file.filename)
+            data = file.read()
             file_path = os.path.join(self.uploads_dir, filename)
-            file.save(file_path)
-            return file_path
-        return None
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            return file_path, data
+        return None, None
     
-    def extract_text_from_pdf(self, file_path):
+    def extract_text_from_pdf(self, data):
         try:
-            doc = fitz.open(file_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            return text
+            return self.pdf_extractor.extract(data)
         except Exception as e:
             return None
     
@@ -155,60 +726,134 @@ class ChatbotService:
                 return f.read()
         return None
     
-    def get_response(self, user_message, user_id, role='user',is_file=False, file_name=None):
-        messages= [{'role': 'system', 'content': 'You are a helpful medical assistant.'}]
+    def build_messages(self, user_message, user_id, role='user', is_file=False, file_name=None):
+        # Returns (messages, cache_key, turn, error). The user turn is not
+        # saved here but once the reply is served (save_turn), so a request
+        # turned away as busy leaves nothing behind to duplicate on retry.
+        # cache_key is None when the reply must not come from (or go to) the
+        # response cache.
+        messages= []
+        cache_key = None
         if is_file and file_name:
             filename = file_name.filename  # extract the name
-            file_path = self.extract_file(file_name)
+            file_path, raw = self.extract_file(file_name)
             if not file_path:
-                return "File upload failed."
+                return None, None, None, "File upload failed."
 
             if filename.lower().endswith('.pdf'):
-                content = self.extract_text_from_pdf(file_path)
-                #write the content to a file
+                content = self.extract_text_from_pdf(raw)
                 if content is None:
-                    return "Failed to extract text from PDF."  
-                with open(os.path.join(self.uploads_dir, filename), 'w', encoding='utf-8') as f:
-                    f.write(content)
+                    return None, None, None, "Failed to extract text from PDF."
 
             else:
-                raw = self.get_file_content(file_path)
                 content = raw.decode('utf-8') if raw else None
 
             if not content:
-                return "Failed to read or extract content from the file."
+                return None, None, None, "Failed to read or extract content from the file."
+
+            prompt = content
+            if self.retrieval:
+                # Only the relevant parts of the document go to the model
+                doc_id, _ = self.retrieval.add_document(user_id, filename, content)
+                if user_message:
+                    excerpts = self.retrieval.search(user_id, user_message, self.retrieval_top_k, doc_id=doc_id)
+                else:
+                    excerpts = self.retrieval.document_chunks(user_id, doc_id, self.retrieval_top_k)
+                question = user_message or 'Give an overview of this document.'
+                prompt = f"I uploaded {filename}. Excerpts:\n\n{format_excerpts(excerpts)}\n\n{question}"
 
             messages.append({
                 'role': role,
-                'content': content,
+                'content': prompt,
                 'is_file': True,
                 'file_name': filename
             })
-
-            self.save_conversation(user_id, role, content, is_file=True, file_name=filename)
         else:
-            self.save_conversation(user_id, role, user_message)
+            if self.retrieval:
+                excerpts = self.retrieval.search(user_id, user_message, self.retrieval_top_k,
+                                                 self.retrieval_min_score)
+                if excerpts:
+                    messages.append({
+                        'role': 'system',
+                        'content': f"Excerpts from documents the doctor uploaded earlier:\n\n{format_excerpts(excerpts)}",
+                        'is_file': False
+                    })
             messages.append({
                 'role': role,
                 'content': user_message,
                 'is_file': False
             })
+        messages = [{'role': msg['role'], 'content': msg['content']} for msg in messages]
+        if self.response_cache and not (is_file and file_name):
+            context = [CHAT_SYSTEM_PROMPT] + [msg['content'] for msg in messages[:-1]]
+            cache_key = self.response_cache.make_key(user_message, context)
+        if cache_key or not self.context:
+            # Standalone question: answered without summary or history, so
+            # the reply only depends on what is in the key
+            messages = [{'role': 'system', 'content': CHAT_SYSTEM_PROMPT}] + messages
+        else:
+            # History is read before this turn is saved, so it isn't sent twice
+            messages = self.context.build(user_id, CHAT_SYSTEM_PROMPT, messages)
+
+        if is_file and file_name:
+            turn = {'role': role, 'content': content, 'is_file': True, 'file_name': filename}
+        else:
+            turn = {'role': role, 'content': user_message}
+        return messages, cache_key, turn, None
+
+    def save_turn(self, user_id, turn):
+        self.save_conversation(user_id, **turn)
+
+    def get_response(self, user_message, user_id, role='user',is_file=False, file_name=None):
+        messages, cache_key, turn, error = self.build_messages(user_message, user_id, role, is_file, file_name)
+        if error:
+            return error
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            self.save_turn(user_id, turn)
+            self.save_conversation(user_id, 'assistant', cached)
+            return cached
         try:
-            messages = [{'role': msg['role'], 'content': msg['content']} for msg in messages]
-            response = ollama.chat(
-                    model="monotykamary/medichat-llama3:8b",
-                    messages= messages,
-                    stream=False
-                )
-            assistant_message = response['message']['content']
+            assistant_message = self.llm.chat(user_id, messages, on_start=lambda: self.save_turn(user_id, turn))
+            if cache_key:
+                self.response_cache.put(cache_key, assistant_message)
 
             self.save_conversation(user_id, 'assistant', assistant_message)
             
             return assistant_message
         
+        except LLMBusy:
+            raise
         except Exception as e:
             return f"Error: {str(e)}"
 
+    def stream_reply(self, messages, user_id, turn, cache_key=None):
+        # Yields tokens as Ollama produces them. The finally block also runs
+        # when the client disconnects (the generator is closed): closing the
+        # LLM stream drops its HTTP connection, which stops generation, and
+        # frees the concurrency slot.
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            self.save_turn(user_id, turn)
+            self.save_conversation(user_id, 'assistant', cached)
+            yield cached
+            return
+        stream = self.llm.stream_chat(user_id, messages, on_start=lambda: self.save_turn(user_id, turn))
+        chunks = []
+        finished = False
+        try:
+            for token in stream:
+                chunks.append(token)
+                yield token
+            finished = True
+        finally:
+            stream.close()
+            if chunks:
+                self.save_conversation(user_id, 'assistant', ''.join(chunks))
+            # Cut-off replies are not cached
+            if finished and cache_key:
+                self.response_cache.put(cache_key, ''.join(chunks))
+
     def save_conversation(self, user_id, role, content, is_file=False, file_name=None):
         conversation = ChatConversation(
             user_id=user_id,
@@ -0,0 +1,72 @@
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.layers import (Conv2D, SeparableConv2D, MaxPooling2D, Flatten, Dense, Dropout,
+                                     GlobalAveragePooling2D, BatchNormalization)
+
+# Model builders used by the training runner. Each takes the input shape, the
+# number of output units and keyword hyperparameters from the run config.
+
+
+def _head(num_outputs):
+    if num_outputs == 1:
+        return Dense(1, activation='sigmoid')
+    return Dense(num_outputs, activation='softmax')
+
+
+def baseline(input_shape, num_outputs, filters=16, dense_units=64, dropout=0.0):
+    # The original hand-written brain/lung model
+    layers = [
+        Conv2D(filters, (3, 3), activation='relu', input_shape=input_shape),
+        MaxPooling2D(2, 2),
+        Flatten(),
+        Dense(dense_units, activation='relu'),
+    ]
+    if dropout:
+        layers.append(Dropout(dropout))
+    layers.append(_head(num_outputs))
+    return Sequential(layers)
+
+
+def small_cnn(input_shape, num_outputs, filters=16, blocks=3, dense_units=64, dropout=0.3):
+    # Deeper conv stack with global pooling instead of a large Flatten/Dense
+    layers = []
+    for block in range(blocks):
+        kwargs = {'input_shape': input_shape} if block == 0 else {}
+        layers += [
+            Conv2D(filters * 2 ** block, (3, 3), padding='same', activation='relu', **kwargs),
+            BatchNormalization(),
+            MaxPooling2D(2, 2),
+        ]
+    layers += [GlobalAveragePooling2D(), Dense(dense_units, activation='relu')]
+    if dropout:
+        layers.append(Dropout(dropout))
+    layers.append(_head(num_outputs))
+    return Sequential(layers)
+
+
+def separable_cnn(input_shape, num_outputs, filters=16, blocks=3, dense_units=32, dropout=0.0):
+    # Depthwise-separable blocks: a fraction of the FLOPs of small_cnn on CPU
+    layers = [Conv2D(filters, (3, 3), strides=2, padding='same', activation='relu', input_shape=input_shape)]
+    for block in range(blocks):
+        layers += [
+            SeparableConv2D(filters * 2 ** (block + 1), (3, 3), padding='same', activation='relu'),
+            BatchNormalization(),
+            MaxPooling2D(2, 2),
+        ]
+    layers += [GlobalAveragePooling2D(), Dense(dense_units, activation='relu')]
+    if dropout:
+        layers.append(Dropout(dropout))
+    layers.append(_head(num_outputs))
+    return Sequential(layers)
+
+
+ARCHITECTURES = {
+    'baseline': baseline,
+    'small_cnn': small_cnn,
+    'separable_cnn': separable_cnn,
+}
+
+
+def build_model(name, input_shape, num_outputs, **params):
+    if name not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture '{name}' (available: {', '.join(sorted(ARCHITECTURES))})")
+    return ARCHITECTURES[name](input_shape, num_outputs, **params)
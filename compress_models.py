@@ -0,0 +1,226 @@
+import os
+import json
+import zlib
+import shutil
+import argparse
+import numpy as np
+import tensorflow as tf
+from architectures import build_model
+from datasets import make_datasets
+from train_runner import load_config, num_outputs
+from export_models import sample_images, evaluate, measure_latency, load_backend, model_filename
+
+# Compression stage after training. The trained model (the teacher) is
+# distilled into smaller global-pooling students, and teacher and students can
+# additionally be magnitude-pruned and fine-tuned. Every candidate is saved
+# next to the report with its parameter count, size, CPU latency and
+# accuracy delta against the teacher. --install copies a chosen candidate over
+# the served model; CancerAnalysisService picks it up on its next reload check.
+
+STUDENTS = {
+    'gap_small': {'architecture': 'small_cnn',
+                  'params': {'filters': 16, 'blocks': 3, 'dense_units': 64, 'dropout': 0.0}},
+    'gap_tiny': {'architecture': 'small_cnn',
+                 'params': {'filters': 8, 'blocks': 3, 'dense_units': 32, 'dropout': 0.0}},
+    'separable': {'architecture': 'separable_cnn',
+                  'params': {'filters': 16, 'blocks': 3, 'dense_units': 32, 'dropout': 0.0}},
+}
+EPSILON = 1e-7
+
+
+def _logits(probs, binary):
+    # The served models end in sigmoid/softmax, so temperatures are applied to
+    # logits recovered from the probabilities
+    probs = tf.clip_by_value(probs, EPSILON, 1 - EPSILON)
+    if binary:
+        return tf.math.log(probs) - tf.math.log(1 - probs)
+    return tf.math.log(probs)
+
+
+def distillation_loss(labels, teacher_probs, student_probs, temperature, alpha, binary):
+    if binary:
+        hard = tf.keras.losses.binary_crossentropy(labels[:, tf.newaxis], student_probs)
+        soft_teacher = tf.sigmoid(_logits(teacher_probs, True) / temperature)
+        soft_student = tf.sigmoid(_logits(student_probs, True) / temperature)
+        soft = tf.keras.losses.binary_crossentropy(soft_teacher, soft_student)
+    else:
+        hard = tf.keras.losses.categorical_crossentropy(labels, student_probs)
+        soft_teacher = tf.nn.softmax(_logits(teacher_probs, False) / temperature)
+        soft_student = tf.nn.softmax(_logits(student_probs, False) / temperature)
+        soft = tf.keras.losses.kl_divergence(soft_teacher, soft_student)
+    return tf.reduce_mean(alpha * hard + (1 - alpha) * temperature ** 2 * soft)
+
+
+def magnitude_masks(model, sparsity):
+    # Per layer: zero the smallest |w| of every conv/dense kernel
+    masks = []
+    for layer in model.layers:
+        for weight in layer.trainable_weights:
+            if 'kernel' not in weight.name:
+                continue
+            values = np.abs(weight.numpy())
+            threshold = np.quantile(values, sparsity)
+            mask = (values > threshold).astype(values.dtype)
+            weight.assign(weight.numpy() * mask)
+            masks.append((weight, tf.constant(mask)))
+    return masks
+
+
+def validation_accuracy(model, ds, binary):
+    correct = total = 0
+    for images, labels in ds:
+        probs = model(images, training=False).numpy()
+        labels = labels.numpy()
+        predicted = (probs[:, 0] > 0.5).astype(int) if binary else probs.argmax(axis=-1)
+        expected = labels.astype(int) if binary else labels.argmax(axis=-1)
+        correct += int((predicted == expected).sum())
+        total += len(expected)
+    return correct / total if total else 0.0
+
+
+def distill(student, teacher, train_ds, val_ds, binary, epochs, learning_rate, temperature, alpha, masks=None):
+    optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+
+    @tf.function
+    def train_step(images, labels):
+        teacher_probs = teacher(images, training=False)
+        with tf.GradientTape() as tape:
+            student_probs = student(images, training=True)
+            loss = distillation_loss(labels, teacher_probs, student_probs, temperature, alpha, binary)
+        grads = tape.gradient(loss, student.trainable_variables)
+        optimizer.apply_gradients(zip(grads, student.trainable_variables))
+        for weight, mask in masks or []:
+            weight.assign(weight * mask)  # keep pruned weights at zero
+        return loss
+
+    # Starting weights if no epoch runs (epochs=0) or none scores
+    best_accuracy, best_weights = -1.0, student.get_weights()
+    for epoch in range(epochs):
+        losses = [float(train_step(images, labels)) for images, labels in train_ds]
+        accuracy = validation_accuracy(student, val_ds, binary)
+        print(f"  epoch {epoch + 1}/{epochs}: loss {np.mean(losses):.4f}, val_accuracy {accuracy:.4f}")
+        if accuracy > best_accuracy:
+            best_accuracy, best_weights = accuracy, student.get_weights()
+    student.set_weights(best_weights)
+    return best_accuracy
+
+
+def count_params(model):
+    weights = model.get_weights()
+    return int(sum(w.size for w in weights)), int(sum(np.count_nonzero(w) for w in weights))
+
+
+def compress_model(image_type, args):
+    run = next(run for run in load_config(args.config) if run['name'] == image_type)
+    binary = run['class_mode'] == 'binary'
+    img_size = tuple(run['img_size'])
+    train_ds, val_ds = make_datasets(run['data_dir'], run['class_mode'], img_size, run['batch_size'],
+                                     run['validation_split'], run['seed'], shard_dir=run['shard_dir'])
+    teacher_path = os.path.join(args.model_dir, model_filename(image_type, 'keras'))
+    teacher = tf.keras.models.load_model(teacher_path)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    candidates = {'teacher': teacher_path}
+    for name in args.students:
+        spec = STUDENTS[name]
+        print(f"{image_type}: distilling into {name}")
+        student = build_model(spec['architecture'], img_size + (3,), num_outputs(run), **spec['params'])
+        distill(student, teacher, train_ds, val_ds, binary, args.epochs, args.learning_rate,
+                args.temperature, args.alpha)
+        candidates[name] = os.path.join(args.out_dir, f"{image_type}_{name}.h5")
+        student.save(candidates[name])
+
+    for name in list(candidates):
+        for sparsity in args.sparsities:
+            print(f"{image_type}: pruning {name} to {sparsity:.0%} sparsity")
+            model = tf.keras.models.load_model(candidates[name])
+            masks = magnitude_masks(model, sparsity)
+            distill(model, teacher, train_ds, val_ds, binary, args.prune_epochs, args.learning_rate / 10,
+                    args.temperature, args.alpha, masks)
+            pruned_name = f"{name}_pruned{int(sparsity * 100)}"
+            candidates[pruned_name] = os.path.join(args.out_dir, f"{image_type}_{pruned_name}.h5")
+            model.save(candidates[pruned_name])
+
+    eval_images, eval_labels = sample_images(os.path.join(args.test_dir, image_type), args.eval_samples, args.seed)
+    report = {}
+    baseline = None
+    for name, path in candidates.items():
+        runner = load_backend('keras', path, num_threads=args.threads)
+        params, nonzero = count_params(runner.model)
+        with open(path, 'rb') as f:
+            compressed_bytes = len(zlib.compress(f.read(), 6))
+        accuracy = evaluate(runner, eval_images, eval_labels)
+        if baseline is None:
+            baseline = accuracy
+        report[name] = {
+            'path': path,
+            'params': params,
+            'nonzero_params': nonzero,
+            'size_bytes': os.path.getsize(path),
+            'compressed_bytes': compressed_bytes,
+            'accuracy': accuracy,
+            'accuracy_delta': accuracy - baseline,
+            'latency': [measure_latency(runner, eval_images, bs, args.repeats) for bs in args.batch_sizes],
+        }
+    return report
+
+
+def print_report(report):
+    for image_type, candidates in report.items():
+        print(f"\n{image_type} model")
+        print(f"{'candidate':<24}{'params':>10}{'nonzero':>10}{'zip (KB)':>10}{'accuracy':>10}{'delta':>9}"
+              f"  latency p50 (ms) by batch size")
+        for name, row in candidates.items():
+            latency = '  '.join(f"bs{l['batch_size']}={l['p50_ms']:.2f}" for l in row['latency'])
+            print(f"{name:<24}{row['params']:>10}{row['nonzero_params']:>10}{row['compressed_bytes'] / 1024:>10.0f}"
+                  f"{row['accuracy']:>10.3f}{row['accuracy_delta']:>+9.3f}  {latency}")
+
+
+def install(report, image_type, name, model_dir):
+    target = os.path.join(model_dir, model_filename(image_type, 'keras'))
+    backup = target + '.teacher'
+    if not os.path.exists(backup):
+        shutil.copy2(target, backup)
+    # Copy next to the target and swap it in, so a worker reloading the
+    # model never reads a half-written file
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    shutil.copy2(report[image_type][name]['path'], tmp_path)
+    os.replace(tmp_path, target)
+    print(f"Installed {image_type} candidate '{name}' as {target} (previous model kept as {backup})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill and prune the trained models and compare the candidates.')
+    parser.add_argument('--config', help='train_runner config with the data settings (default: built-in)')
+    parser.add_argument('--model-dir', default='HealthWave/models')
+    parser.add_argument('--out-dir', default='compressed_models')
+    parser.add_argument('--test-dir', default='../Data/test')
+    parser.add_argument('--models', nargs='+', default=['brain', 'lung'])
+    parser.add_argument('--students', nargs='*', default=list(STUDENTS), choices=list(STUDENTS))
+    parser.add_argument('--sparsities', type=float, nargs='*', default=[0.5, 0.8])
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--prune-epochs', type=int, default=3)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--alpha', type=float, default=0.3, help='Weight of the hard-label loss')
+    parser.add_argument('--eval-samples', type=int, default=500)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--report', default='compression_report.json')
+    parser.add_argument('--install', nargs=2, action='append', metavar=('MODEL', 'CANDIDATE'),
+                        help='Copy a candidate over the served model, e.g. --install brain gap_small')
+    args = parser.parse_args()
+
+    report = {image_type: compress_model(image_type, args) for image_type in args.models}
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nReport written to {args.report}")
+    for image_type, name in args.install or []:
+        install(report, image_type, name, args.model_dir)
+
+
+if __name__ == '__main__':
+    main()
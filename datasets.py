@@ -0,0 +1,506 @@
+import os
+import json
+import math
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+AUTOTUNE = tf.data.AUTOTUNE
+SHARD_INDEX = 'index.json'
+SHARD_SIZE = 4096
+SHARD_LAYOUT = 'shuffled-split'
+
+# Same augmentation ranges as the original ImageDataGenerator
+AUGMENTATION = {
+    'rotation_range': 20,
+    'width_shift_range': 0.2,
+    'height_shift_range': 0.2,
+    'shear_range': 0.2,
+    'zoom_range': 0.2,
+    'horizontal_flip': True,
+}
+
+
+def list_split(directory, subset, validation_split=0.2):
+    # Mirrors flow_from_directory: classes are the sorted sub-directories and,
+    # per class, the first `validation_split` of the sorted files is validation.
+    classes = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    paths, labels = [], []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(directory, class_name)
+        files = sorted(
+            os.path.join(root, f)
+            for root, _, filenames in os.walk(class_dir)
+            for f in filenames if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        cut = int(validation_split * len(files))
+        selected = files[:cut] if subset == 'validation' else files[cut:]
+        paths.extend(selected)
+        labels.extend([label] * len(selected))
+    return paths, labels, classes
+
+
+def _decode(path, img_size):
+    img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    # load_img in flow_from_directory resizes with nearest neighbour
+    img = tf.image.resize(img, img_size, method='nearest')
+    return tf.cast(img, tf.uint8)
+
+
+def _affine_transforms(generator, batch_size, height, width, augmentation):
+    # One output->input projective transform per image, built for the whole
+    # batch at once (rotation, shear, zoom, flip about the centre, then shift)
+    def uniform(limit):
+        return generator.uniform([batch_size], -limit, limit)
+
+    theta = uniform(augmentation['rotation_range']) * (math.pi / 180)
+    shear = uniform(augmentation['shear_range']) * (math.pi / 180)  # degrees, as in ImageDataGenerator
+    zoom_x = 1 + uniform(augmentation['zoom_range'])
+    zoom_y = 1 + uniform(augmentation['zoom_range'])
+    shift_x = uniform(augmentation['width_shift_range']) * width
+    shift_y = uniform(augmentation['height_shift_range']) * height
+    flip = tf.ones([batch_size])
+    if augmentation['horizontal_flip']:
+        flip = tf.where(generator.uniform([batch_size]) < 0.5, -1.0, 1.0)
+
+    a0 = tf.cos(theta) * zoom_x * flip
+    a1 = -tf.sin(theta + shear) * zoom_y
+    b0 = tf.sin(theta) * zoom_x * flip
+    b1 = tf.cos(theta + shear) * zoom_y
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    a2 = cx - a0 * cx - a1 * cy + shift_x
+    b2 = cy - b0 * cx - b1 * cy + shift_y
+    zeros = tf.zeros([batch_size])
+    return tf.stack([a0, a1, a2, b0, b1, b2, zeros, zeros], axis=1)
+
+
+def make_augmenter(img_size, seed, augmentation=None):
+    augmentation = augmentation or AUGMENTATION
+    generator = tf.random.Generator.from_seed(seed)
+    height, width = img_size
+
+    def augment(images, labels):
+        transforms = _affine_transforms(generator, tf.shape(images)[0], height, width, augmentation)
+        images = tf.raw_ops.ImageProjectiveTransformV3(
+            images=images,
+            transforms=transforms,
+            output_shape=tf.constant(img_size, dtype=tf.int32),
+            fill_value=0.0,
+            interpolation='BILINEAR',
+            fill_mode='NEAREST'
+        )
+        return images, labels
+
+    return augment
+
+
+def make_dataset(directory, class_mode, subset, img_size=(128, 128), batch_size=8,
+                 validation_split=0.2, seed=42, augment=True, cache=True):
+    paths, labels, classes = list_split(directory, subset, validation_split)
+    ds = path_dataset(paths, labels, len(classes), class_mode, subset == 'training', img_size,
+                      batch_size, seed, augment, cache)
+    return ds, len(paths), classes
+
+
+def path_dataset(paths, labels, num_classes, class_mode, training, img_size=(128, 128), batch_size=8,
+                 seed=42, augment=True, cache=True):
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.map(lambda path, label: (_decode(path, img_size), label),
+                num_parallel_calls=AUTOTUNE, deterministic=True)
+    if cache:
+        # Decoded 128x128 uint8 images are small; decode once, not per epoch
+        ds = ds.cache(cache if isinstance(cache, str) else '')
+    if training:
+        ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    return finish_dataset(ds, class_mode, num_classes, img_size, seed, augment and training)
+
+
+def finish_dataset(ds, class_mode, num_classes, img_size, seed, augment):
+    # Shared tail of the pipeline: rescale, encode labels, augment, prefetch
+    def to_float(images, labels):
+        images = tf.cast(images, tf.float32) * (1.0 / 255)
+        if class_mode == 'categorical':
+            labels = tf.one_hot(labels, num_classes)
+        else:
+            labels = tf.cast(labels, tf.float32)
+        return images, labels
+
+    ds = ds.map(to_float, num_parallel_calls=AUTOTUNE, deterministic=True)
+    if augment:
+        # Sequential so the random generator is consumed in a fixed order; the
+        # transform itself is a single vectorized op over the batch
+        ds = ds.map(make_augmenter(img_size, seed))
+    options = tf.data.Options()
+    options.deterministic = True
+    return ds.with_options(options).prefetch(AUTOTUNE)
+
+
+def make_datasets(directory, class_mode, img_size=(128, 128), batch_size=8, validation_split=0.2, seed=42,
+                  shard_dir=None):
+    if shard_dir:
+        # Incremental: only new or changed files are decoded
+        build_shards(directory, shard_dir, img_size, validation_split=validation_split)
+        factory = lambda subset, augment: make_shard_dataset(shard_dir, class_mode, subset, batch_size,
+                                                             validation_split, seed, augment)
+    else:
+        factory = lambda subset, augment: make_dataset(directory, class_mode, subset, img_size,
+                                                       batch_size, validation_split, seed, augment)
+    train_ds, train_count, classes = factory('training', True)
+    val_ds, val_count, _ = factory('validation', False)
+    print(f"Found {train_count} training and {val_count} validation images "
+          f"belonging to {len(classes)} classes in {directory}.")
+    return train_ds, val_ds
+
+
+def make_finetune_datasets(new_dir, old_dir, class_mode, img_size=(128, 128), batch_size=8, replay_ratio=1.0,
+                           validation_split=0.2, seed=42):
+    # Incremental fine-tuning: all newly labeled images plus a random replay
+    # sample of the original training data (replay_ratio old images per new
+    # one) so the model doesn't forget. Validation covers both, to catch
+    # regressions on the old data as well as gains on the new.
+    new_train, new_train_labels, classes = list_split(new_dir, 'training', validation_split)
+    new_val, new_val_labels, _ = list_split(new_dir, 'validation', validation_split)
+    old_train, old_train_labels, old_classes = list_split(old_dir, 'training', validation_split)
+    old_val, old_val_labels, _ = list_split(old_dir, 'validation', validation_split)
+    if classes != old_classes:
+        raise ValueError(f"Classes in {new_dir} {classes} don't match {old_dir} {old_classes}")
+
+    rng = np.random.default_rng(seed)
+    replay = rng.permutation(len(old_train))[:int(replay_ratio * len(new_train))]
+    val_replay = rng.permutation(len(old_val))[:max(len(new_val), int(replay_ratio * len(new_val)))]
+    train_paths = new_train + [old_train[i] for i in replay]
+    train_labels = new_train_labels + [old_train_labels[i] for i in replay]
+    val_paths = new_val + [old_val[i] for i in val_replay]
+    val_labels = new_val_labels + [old_val_labels[i] for i in val_replay]
+
+    train_ds = path_dataset(train_paths, train_labels, len(classes), class_mode, True, img_size, batch_size, seed)
+    val_ds = path_dataset(val_paths, val_labels, len(classes), class_mode, False, img_size, batch_size, seed)
+    print(f"Fine-tuning on {len(new_train)} new and {len(replay)} replayed images, "
+          f"validating on {len(new_val)} new and {len(val_replay)} old images.")
+    return train_ds, val_ds
+
+
+# Pre-decoded shards: every image is decoded and resized once into uint8
+# .npy shards that are memory-mapped at training time. index.json maps each
+# source file (by relative path, mtime and size) to a (shard, row) slot.
+# Rows are written in a seeded random order, validation files first, so any
+# run of consecutive training rows is a class-mixed batch that can be read
+# as a slice of the mapping.
+
+def _load_index(shard_dir):
+    path = os.path.join(shard_dir, SHARD_INDEX)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _decode_file(path, img_size):
+    with Image.open(path) as img:
+        # Nearest neighbour, like the tf.data and flow_from_directory paths
+        return np.asarray(img.convert('RGB').resize(img_size[::-1], Image.NEAREST), dtype=np.uint8)
+
+
+def _validation_files(labels, validation_split):
+    # Same per-class rule as list_split: the first files of each class
+    by_class = {}
+    for rel in sorted(labels):
+        by_class.setdefault(labels[rel], []).append(rel)
+    return {rel for rels in by_class.values() for rel in rels[:int(validation_split * len(rels))]}
+
+
+def build_shards(source_dir, shard_dir, img_size=(128, 128), workers=None, compact_ratio=0.5,
+                 validation_split=0.2, seed=0):
+    os.makedirs(shard_dir, exist_ok=True)
+    index = _load_index(shard_dir)
+    if index is not None and tuple(index['img_size']) != tuple(img_size):
+        index = None
+    if index is None:
+        index = {'img_size': list(img_size), 'shards': [], 'files': {}}
+
+    classes = sorted(d for d in os.listdir(source_dir) if os.path.isdir(os.path.join(source_dir, d)))
+    current = {}
+    for label, class_name in enumerate(classes):
+        for root, _, filenames in os.walk(os.path.join(source_dir, class_name)):
+            for f in filenames:
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, f)
+                    stat = os.stat(path)
+                    current[os.path.relpath(path, source_dir)] = (label, stat.st_mtime_ns, stat.st_size)
+
+    files = {}
+    pending = []
+    for rel, (label, mtime_ns, size) in sorted(current.items()):
+        entry = index['files'].get(rel)
+        if entry and entry['mtime_ns'] == mtime_ns and entry['size'] == size:
+            entry['label'] = label
+            files[rel] = entry
+        else:
+            pending.append(rel)
+
+    live_rows = len(files)
+    total_rows = sum(shard['count'] for shard in index['shards'])
+    if total_rows and (live_rows < compact_ratio * total_rows or index.get('layout') != SHARD_LAYOUT):
+        # Too many dead rows from changed/removed files, or shards from the
+        # old class-sorted layout: start over
+        print(f"Compacting shards in {shard_dir}")
+        # The old shards stay until the new index is in place
+        index['shards'] = []
+        pending = sorted(current)
+        files = {}
+
+    if not pending and len(files) == len(index['files']) and index.get('classes') == classes:
+        print(f"Shards in {shard_dir} are up to date ({len(files)} images)")
+        return index
+
+    validation = _validation_files({rel: entry[0] for rel, entry in current.items()}, validation_split)
+    shuffled = [pending[i] for i in np.random.default_rng(seed).permutation(len(pending))]
+    pending = [rel for rel in shuffled if rel in validation] + [rel for rel in shuffled if rel not in validation]
+
+    # New shards never reuse a file name on disk, so the current index stays
+    # valid until it is replaced
+    numbers = [int(name[6:-4]) for name in os.listdir(shard_dir)
+               if name.startswith('shard_') and name.endswith('.npy') and name[6:-4].isdigit()]
+    next_number = max(numbers, default=-1) + 1
+    height, width = img_size
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(pending), SHARD_SIZE):
+            chunk = pending[start:start + SHARD_SIZE]
+            name = f"shard_{next_number:05d}.npy"
+            next_number += 1
+            shard = np.lib.format.open_memmap(os.path.join(shard_dir, name), mode='w+',
+                                              dtype=np.uint8, shape=(len(chunk), height, width, 3))
+            paths = [os.path.join(source_dir, rel) for rel in chunk]
+            for row, pixels in enumerate(pool.map(lambda path: _decode_file(path, img_size), paths)):
+                shard[row] = pixels
+            shard.flush()
+            del shard
+            for row, rel in enumerate(chunk):
+                label, mtime_ns, size = current[rel]
+                files[rel] = {'shard': len(index['shards']), 'row': row, 'label': label,
+                              'mtime_ns': mtime_ns, 'size': size}
+            index['shards'].append({'name': name, 'count': len(chunk)})
+
+    index['classes'] = classes
+    index['layout'] = SHARD_LAYOUT
+    index['files'] = files
+    tmp_path = os.path.join(shard_dir, SHARD_INDEX + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(shard_dir, SHARD_INDEX))
+    # Only now drop shards the index no longer uses: compacted ones, a
+    # different img_size, or leftovers of an interrupted build
+    live = {shard['name'] for shard in index['shards']}
+    for name in os.listdir(shard_dir):
+        if name.startswith('shard_') and name.endswith('.npy') and name not in live:
+            os.remove(os.path.join(shard_dir, name))
+    print(f"Encoded {len(pending)} new or changed images into {shard_dir} ({len(files)} total)")
+    return index
+
+
+class ShardReader:
+    def __init__(self, shard_dir, subset, validation_split=0.2):
+        index = _load_index(shard_dir)
+        if index is None:
+            raise FileNotFoundError(f"No shard index in {shard_dir}, run build_shards first")
+        self.classes = index['classes']
+        self.shards = [np.load(os.path.join(shard_dir, shard['name']), mmap_mode='r')
+                       for shard in index['shards']]
+
+        # Same per-class split as list_split / flow_from_directory
+        by_class = {}
+        for rel, entry in sorted(index['files'].items()):
+            by_class.setdefault(entry['label'], []).append(entry)
+        slots = []
+        for label in sorted(by_class):
+            entries = by_class[label]
+            cut = int(validation_split * len(entries))
+            slots.extend(entries[:cut] if subset == 'validation' else entries[cut:])
+        # Storage order, so consecutive slots are mostly consecutive rows
+        slots.sort(key=lambda entry: (entry['shard'], entry['row']))
+        self.shard_ids = np.array([entry['shard'] for entry in slots], dtype=np.int64)
+        self.rows = np.array([entry['row'] for entry in slots], dtype=np.int64)
+        self.labels = np.array([entry['label'] for entry in slots], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def spans(self, batch_size, rng=None):
+        # Batches are runs of consecutive slots. For training the block
+        # boundaries move by a random offset and the blocks are shuffled
+        # every epoch; rows are stored shuffled, so that is enough mixing.
+        count = len(self)
+        offset = int(rng.integers(batch_size)) if rng is not None else 0
+        bounds = [0] + list(range(offset or batch_size, count, batch_size)) + [count]
+        spans = [(start, stop) for start, stop in zip(bounds, bounds[1:]) if stop > start]
+        if rng is not None:
+            spans = [spans[i] for i in rng.permutation(len(spans))]
+        return spans
+
+    def batch(self, start, stop):
+        shard_ids, rows = self.shard_ids[start:stop], self.rows[start:stop]
+        if (shard_ids == shard_ids[0]).all() and (np.diff(rows) == 1).all():
+            # Contiguous rows of one shard: a view straight into the mapping
+            images = self.shards[shard_ids[0]][rows[0]:rows[-1] + 1]
+        else:
+            images = np.stack([self.shards[s][r] for s, r in zip(shard_ids, rows)])
+        return images, self.labels[start:stop]
+
+
+def make_shard_dataset(shard_dir, class_mode, subset, batch_size=8, validation_split=0.2, seed=42, augment=True):
+    reader = ShardReader(shard_dir, subset, validation_split)
+    height, width = reader.shards[0].shape[1:3] if reader.shards else (128, 128)
+    training = subset == 'training'
+    rng = np.random.default_rng(seed)
+
+    # Only the (start, stop) spans come from Python; the batches are read in
+    # parallel map calls
+    def generate():
+        yield from reader.spans(batch_size, rng if training else None)
+
+    def read(span):
+        start, stop = span.numpy()
+        return reader.batch(start, stop)
+
+    def load(span):
+        images, labels = tf.py_function(read, [span], (tf.uint8, tf.int64))
+        images.set_shape((None, height, width, 3))
+        labels.set_shape((None,))
+        return images, labels
+
+    ds = tf.data.Dataset.from_generator(generate, output_signature=tf.TensorSpec((2,), tf.int64))
+    ds = ds.map(load, num_parallel_calls=AUTOTUNE, deterministic=True)
+    return finish_dataset(ds, class_mode, len(reader.classes), (height, width), seed,
+                          augment and training), len(reader), reader.classes
+
+
+class InputTimingCallback(Callback):
+    # Splits each training step into time blocked on the input pipeline and
+    # compute. Keras fetches the batch inside the train function, between
+    # on_train_batch_begin and on_train_batch_end, so the gap between
+    # callbacks says nothing about input. Instead wrap() appends a sequential
+    # map after the prefetch; it runs in the step's own fetch and stamps the
+    # moment the batch actually arrived.
+    def __init__(self):
+        super().__init__()
+        self.history = []
+        self.last_wait = 0.0
+        self.last_compute = 0.0
+        self._received = None
+
+    def _mark(self):
+        self._received = time.perf_counter()
+        return 0
+
+    def wrap(self, ds):
+        def mark(images, labels):
+            stamp = tf.py_function(self._mark, [], tf.int32)
+            with tf.control_dependencies([stamp]):
+                return tf.identity(images), labels
+        return ds.map(mark)
+
+    def on_train_begin(self, logs=None):
+        self._first_step = True
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._input_wait = 0.0
+        self._compute = 0.0
+        self._steps = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._received = None
+        self._batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        end = time.perf_counter()
+        received = self._received
+        if self._first_step or received is None or not self._batch_start <= received <= end:
+            # The first step traces the train function before fetching, and
+            # an unwrapped dataset gives no stamp: count it all as compute
+            received = self._batch_start
+        self._first_step = False
+        self.last_wait = received - self._batch_start
+        self.last_compute = end - received
+        self._input_wait += self.last_wait
+        self._compute += self.last_compute
+        self._steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        total = self._input_wait + self._compute
+        share = self._input_wait / total if total else 0.0
+        self.history.append({
+            'epoch': epoch + 1,
+            'steps': self._steps,
+            'input_wait_s': self._input_wait,
+            'compute_s': self._compute,
+            'input_wait_share': share,
+        })
+        print(f"\nEpoch {epoch + 1}: input wait {self._input_wait:.2f}s ({share:.0%}), "
+              f"compute {self._compute:.2f}s over {self._steps} steps")
+
+
+class TrainingStateCallback(Callback):
+    # Companion to BackupAndRestore, which brings back weights, optimizer and
+    # the epoch counter after an interruption but not the metric history, the
+    # best score so far or EarlyStopping's patience counter. Those are kept in
+    # a small JSON file per run. Must come after the EarlyStopping callback,
+    # so its state is restored after and saved after EarlyStopping's own.
+    def __init__(self, path, early_stopping=None):
+        super().__init__()
+        self.path = path
+        self.early_stopping = early_stopping
+        self.state = {'epochs': {}, 'best_val_accuracy': None, 'early_stopping': None}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def on_train_begin(self, logs=None):
+        saved = self.state.get('early_stopping')
+        if self.early_stopping is not None and saved:
+            self.early_stopping.wait = saved['wait']
+            self.early_stopping.best = saved['best']
+            self.early_stopping.best_epoch = saved['best_epoch']
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = {key: float(value) for key, value in (logs or {}).items()}
+        self.state['epochs'][str(epoch)] = logs
+        best = self.state['best_val_accuracy']
+        if 'val_accuracy' in logs and (best is None or logs['val_accuracy'] > best):
+            self.state['best_val_accuracy'] = logs['val_accuracy']
+        if self.early_stopping is not None:
+            es_best = self.early_stopping.best
+            self.state['early_stopping'] = {
+                'wait': int(self.early_stopping.wait),
+                'best': float(es_best) if es_best is not None else None,
+                'best_epoch': int(self.early_stopping.best_epoch),
+            }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def history(self):
+        # Keyed by epoch: an epoch redone after a crash replaces its entry
+        epochs = [self.state['epochs'][key] for key in sorted(self.state['epochs'], key=int)]
+        keys = epochs[0] if epochs else {}
+        return {key: [logs[key] for logs in epochs if key in logs] for key in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or update pre-decoded uint8 dataset shards.')
+    parser.add_argument('source_dir', help='Class-per-folder image directory, e.g. ../Data/train/brain')
+    parser.add_argument('shard_dir', help='Where to write the .npy shards and index.json')
+    parser.add_argument('--img-size', type=int, nargs=2, default=[128, 128])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    build_shards(args.source_dir, args.shard_dir, tuple(args.img_size), workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+from PIL import Image
+import tensorflow as tf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'HealthWave'))
+from inference_backends import load_backend, model_filename
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+img_size = (128, 128)
+
+
+def list_images(data_dir):
+    # Same class ordering as flow_from_directory: sorted sub-directory names
+    classes = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    samples = []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(data_dir, class_name)
+        for f in sorted(os.listdir(class_dir)):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(class_dir, f), label))
+    return samples
+
+
+def load_images(paths):
+    batch = np.empty((len(paths),) + img_size + (3,), dtype=np.float32)
+    for i, path in enumerate(paths):
+        with Image.open(path) as img:
+            batch[i] = np.asarray(img.convert('RGB').resize(img_size), dtype=np.float32)
+    batch *= 1.0 / 255.0
+    return batch
+
+
+def sample_images(data_dir, count, seed):
+    samples = list_images(data_dir)
+    random.Random(seed).shuffle(samples)
+    samples = samples[:count]
+    return load_images([p for p, _ in samples]), np.array([label for _, label in samples])
+
+
+def convert_tflite(model, out_path, mode, calibration=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if mode == 'fp16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        def representative_dataset():
+            for i in range(len(calibration)):
+                yield [calibration[i:i + 1]]
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(out_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def convert_onnx(model, out_path):
+    try:
+        import tf2onnx
+    except ImportError:
+        print("tf2onnx is not installed, skipping ONNX export")
+        return False
+    spec = (tf.TensorSpec((None,) + img_size + (3,), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=out_path)
+    return True
+
+
+def predicted_labels(predictions):
+    if predictions.shape[-1] == 1:
+        return (predictions[:, 0] > 0.5).astype(int)
+    return predictions.argmax(axis=-1)
+
+
+def measure_latency(backend, images, batch_size, repeats):
+    batch = images[:batch_size]
+    if len(batch) < batch_size:
+        batch = np.resize(images, (batch_size,) + images.shape[1:])
+    backend.predict(batch)  # warm-up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend.predict(batch)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000.0
+    return {
+        'batch_size': batch_size,
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'images_per_sec': float(batch_size * repeats / (timings.sum() / 1000.0)),
+    }
+
+
+def evaluate(backend, images, labels, batch_size=32):
+    predictions = np.concatenate([
+        backend.predict(images[start:start + batch_size])
+        for start in range(0, len(images), batch_size)
+    ])
+    return float((predicted_labels(predictions) == labels).mean())
+
+
+def export_model(image_type, args):
+    keras_path = os.path.join(args.model_dir, model_filename(image_type, 'keras'))
+    model = tf.keras.models.load_model(keras_path)
+    calibration, _ = sample_images(os.path.join(args.train_dir, image_type), args.calibration_samples, args.seed)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    backends = ['keras']
+    for backend, mode in (('tflite', 'float32'), ('tflite-fp16', 'fp16'), ('tflite-int8', 'int8')):
+        out_path = os.path.join(args.out_dir, model_filename(image_type, backend))
+        convert_tflite(model, out_path, mode, calibration)
+        backends.append(backend)
+        print(f"{image_type}: wrote {out_path}")
+    onnx_path = os.path.join(args.out_dir, model_filename(image_type, 'onnx'))
+    if convert_onnx(model, onnx_path):
+        backends.append('onnx')
+        print(f"{image_type}: wrote {onnx_path}")
+
+    eval_images, eval_labels = sample_images(os.path.join(args.test_dir, image_type), args.eval_samples, args.seed)
+    report = {}
+    baseline = None
+    for backend in backends:
+        directory = args.model_dir if backend == 'keras' else args.out_dir
+        runner = load_backend(backend, os.path.join(directory, model_filename(image_type, backend)), num_threads=args.threads)
+        accuracy = evaluate(runner, eval_images, eval_labels)
+        if baseline is None:
+            baseline = accuracy
+        report[backend] = {
+            'size_bytes': os.path.getsize(os.path.join(directory, model_filename(image_type, backend))),
+            'accuracy': accuracy,
+            'accuracy_delta': accuracy - baseline,
+            'latency': [measure_latency(runner, eval_images, bs, args.repeats) for bs in args.batch_sizes],
+        }
+    return report
+
+
+def print_report(report):
+    for image_type, backends in report.items():
+        print(f"\n{image_type} model")
+        print(f"{'backend':<14}{'size (KB)':>11}{'accuracy':>10}{'delta':>9}  latency p50 (ms) by batch size")
+        for backend, row in backends.items():
+            latency = '  '.join(f"bs{l['batch_size']}={l['p50_ms']:.2f}" for l in row['latency'])
+            print(f"{backend:<14}{row['size_bytes'] / 1024:>11.0f}{row['accuracy']:>10.3f}{row['accuracy_delta']:>+9.3f}  {latency}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the trained models to TFLite/ONNX and compare CPU backends.')
+    parser.add_argument('--model-dir', default='HealthWave/models')
+    parser.add_argument('--out-dir', default='HealthWave/models')
+    parser.add_argument('--train-dir', default='../Data/train')
+    parser.add_argument('--test-dir', default='../Data/test')
+    parser.add_argument('--models', nargs='+', default=['brain', 'lung'])
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--eval-samples', type=int, default=500)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--report', default='export_report.json')
+    args = parser.parse_args()
+
+    report = {image_type: export_model(image_type, args) for image_type in args.models}
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nReport written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
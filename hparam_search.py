@@ -0,0 +1,160 @@
+import os
+import json
+import argparse
+import numpy as np
+from train_runner import load_config, run_parallel, available_cores
+
+# Hyperparameter search with successive halving. Every trial starts with a
+# small epoch budget; after each rung only the best 1/eta by val_accuracy are
+# retrained with eta times the budget, the rest are pruned. Trials of a rung
+# run in parallel through the training runner. Every finished trial is
+# appended to a JSONL results store, and a rerun of the same study skips
+# what is already there. The winner is written as a train_runner config:
+#
+#   python hparam_search.py --run brain --trials 27
+#   python train_runner.py --config best_brain.json
+
+SEARCH_SPACE = {
+    'learning_rate': {'loguniform': [1e-5, 1e-2]},
+    'batch_size': {'choice': [8, 16, 32]},
+    'architecture': {'choice': ['baseline', 'small_cnn']},
+    'params.filters': {'choice': [8, 16, 32]},
+    'params.dense_units': {'choice': [32, 64, 128]},
+    'params.dropout': {'choice': [0.0, 0.2, 0.4]},
+}
+
+
+def sample_config(space, rng):
+    sample = {}
+    for key, spec in sorted(space.items()):
+        if 'choice' in spec:
+            sample[key] = spec['choice'][int(rng.integers(len(spec['choice'])))]
+        elif 'loguniform' in spec:
+            low, high = spec['loguniform']
+            sample[key] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        elif 'uniform' in spec:
+            sample[key] = float(rng.uniform(*spec['uniform']))
+        else:
+            raise ValueError(f"Unsupported search space entry for '{key}': {spec}")
+    return sample
+
+
+def apply_sample(base, sample):
+    # Dotted keys ('params.filters') go into the architecture parameters
+    run = {**base, 'params': dict(base['params'])}
+    for key, value in sample.items():
+        if key.startswith('params.'):
+            run['params'][key[len('params.'):]] = value
+        else:
+            run[key] = value
+    return run
+
+
+def load_results(store_path, study):
+    results = {}
+    if os.path.exists(store_path):
+        with open(store_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['study'] == study:
+                    results[(record['trial'], record['epochs'])] = record
+    return results
+
+
+def append_result(store_path, record):
+    with open(store_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def successive_halving(base, space, study, trials, eta=3, min_epochs=2, max_epochs=18,
+                       parallel=None, cores_per_run=None, store_path='hparam_results.jsonl', seed=0):
+    rng = np.random.default_rng(seed)
+    candidates = [(trial, sample_config(space, rng)) for trial in range(trials)]
+    finished = load_results(store_path, study)
+    if base['shard_dir']:
+        # Once up front, so concurrent trials only ever read the shards
+        from datasets import build_shards
+        build_shards(base['data_dir'], base['shard_dir'], tuple(base['img_size']))
+    epochs = min_epochs
+    while True:
+        records, runs = [], []
+        for trial, sample in candidates:
+            if (trial, epochs) in finished:
+                records.append(finished[(trial, epochs)])
+                continue
+            run = apply_sample(base, sample)
+            run.update(name=f"{study}-t{trial:03d}-e{epochs}", epochs=epochs, output=None)
+            runs.append((trial, sample, run))
+
+        if runs:
+            print(f"Rung at {epochs} epochs: {len(runs)} trials to run, {len(records)} already in {store_path}")
+            by_name = {run['name']: (trial, sample) for trial, sample, run in runs}
+            for result in run_parallel([run for _, _, run in runs], parallel, cores_per_run):
+                trial, sample = by_name[result['name']]
+                record = {
+                    'study': study,
+                    'trial': trial,
+                    'epochs': epochs,
+                    'sample': sample,
+                    'best_val_accuracy': result.get('best_val_accuracy'),
+                    'epochs_run': result.get('epochs_run'),
+                    'wall_time_s': result.get('wall_time_s'),
+                    'metrics': result.get('metrics'),
+                    'error': result.get('error'),
+                }
+                append_result(store_path, record)
+                records.append(record)
+
+        ranked = sorted((r for r in records if r['best_val_accuracy'] is not None),
+                        key=lambda r: r['best_val_accuracy'], reverse=True)
+        if epochs >= max_epochs or len(ranked) <= 1:
+            return ranked
+        keep = max(1, len(ranked) // eta)
+        print(f"Rung at {epochs} epochs: promoting {keep} of {len(ranked)} trials "
+              f"(cut-off val_accuracy {ranked[keep - 1]['best_val_accuracy']:.4f})")
+        candidates = [(r['trial'], r['sample']) for r in ranked[:keep]]
+        epochs = min(max_epochs, epochs * eta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Successive-halving hyperparameter search over train_runner runs.')
+    parser.add_argument('--run', required=True, help='Name of the base run in the training config, e.g. brain')
+    parser.add_argument('--config', help='train_runner config file (default: the built-in brain/lung config)')
+    parser.add_argument('--space', help='JSON file with the search space (default: SEARCH_SPACE)')
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--min-epochs', type=int, default=2)
+    parser.add_argument('--max-epochs', type=int, default=18)
+    parser.add_argument('--parallel', type=int, default=max(1, len(available_cores()) // 2))
+    parser.add_argument('--cores-per-run', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--study', help='Study name in the results store (default: <run>-seed<seed>)')
+    parser.add_argument('--store', default='hparam_results.jsonl')
+    parser.add_argument('--best-config', help='Where to write the winning config (default: best_<run>.json)')
+    args = parser.parse_args()
+
+    base = next((run for run in load_config(args.config) if run['name'] == args.run), None)
+    if base is None:
+        parser.error(f"No run named '{args.run}' in the training config")
+    space = SEARCH_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    study = args.study or f"{args.run}-seed{args.seed}"
+
+    ranked = successive_halving(base, space, study, args.trials, args.eta, args.min_epochs, args.max_epochs,
+                                args.parallel, args.cores_per_run, args.store, args.seed)
+    if not ranked:
+        parser.exit(1, 'Every trial failed, see the results store for errors\n')
+
+    best = ranked[0]
+    print(f"Best trial {best['trial']}: val_accuracy {best['best_val_accuracy']:.4f} "
+          f"at {best['epochs']} epochs with {best['sample']}")
+    best_path = args.best_config or f"best_{args.run}.json"
+    with open(best_path, 'w') as f:
+        json.dump({'runs': [apply_sample(base, best['sample'])]}, f, indent=2)
+    print(f"Winning config written to {best_path}; train it with: python train_runner.py --config {best_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+# Perceptual-hash index of an image corpus. Each image gets a 64-bit
+# difference hash (dHash); images within a small Hamming distance are
+# near-duplicates and are clustered so they can be kept on one side of a
+# train/test split. Hashes are stored next to the corpus and only new or
+# changed files are re-hashed.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+HASH_SIZE = 8
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def dhash(path):
+    with Image.open(path) as img:
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        pixels = np.asarray(img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def _hash_file(path):
+    try:
+        return dhash(path)
+    except OSError:
+        return None
+
+
+def default_index_path(source_dir):
+    source_dir = os.path.normpath(source_dir)
+    return os.path.join(os.path.dirname(source_dir), f"{os.path.basename(source_dir)}_phash.json")
+
+
+def build_index(source_dir, index_path=None, workers=None):
+    index_path = index_path or default_index_path(source_dir)
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    current = {}
+    for root, _, filenames in os.walk(source_dir):
+        for f in filenames:
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, f)
+                stat = os.stat(path)
+                current[os.path.relpath(path, source_dir)] = (stat.st_mtime_ns, stat.st_size)
+
+    entries = {}
+    pending = []
+    for rel, (mtime_ns, size) in current.items():
+        entry = index.get(rel)
+        if entry and entry['mtime_ns'] == mtime_ns and entry['size'] == size:
+            entries[rel] = entry
+        else:
+            pending.append(rel)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            paths = [os.path.join(source_dir, rel) for rel in pending]
+            for rel, value in zip(pending, pool.map(_hash_file, paths, chunksize=64)):
+                if value is None:
+                    continue  # unreadable image, left out of the index
+                mtime_ns, size = current[rel]
+                entries[rel] = {'hash': f"{value:016x}", 'mtime_ns': mtime_ns, 'size': size}
+
+    if pending or len(entries) != len(index):
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, index_path)
+    print(f"Hashed {len(pending)} new or changed images in {source_dir} ({len(entries)} indexed)")
+    return entries
+
+
+def hamming(a, b):
+    x = np.ascontiguousarray(np.atleast_1d(np.bitwise_xor(a, b)), dtype=np.uint64)
+    return _POPCOUNT[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def cluster(hashes, max_distance=6):
+    # Multi-index hashing: split the 64 bits into max_distance + 1 bands. Two
+    # hashes within max_distance bits must agree exactly on at least one band
+    # (pigeonhole), so only hashes sharing a band bucket are compared.
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    parent = np.arange(len(hashes))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    bands = max_distance + 1
+    edges = np.linspace(0, 64, bands + 1).astype(int)
+    for low, high in zip(edges[:-1], edges[1:]):
+        mask = np.uint64((1 << (high - low)) - 1)
+        keys = (hashes >> np.uint64(low)) & mask
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+        for bucket in np.split(order, boundaries):
+            if len(bucket) < 2:
+                continue
+            for offset, i in enumerate(bucket[:-1]):
+                others = bucket[offset + 1:]
+                close = others[hamming(hashes[others], hashes[i]) <= max_distance]
+                for j in close:
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    return np.array([find(i) for i in range(len(hashes))])
+
+
+def find_clusters(source_dir, index_path=None, max_distance=6, workers=None):
+    entries = build_index(source_dir, index_path, workers)
+    names = sorted(entries)
+    labels = cluster([int(entries[name]['hash'], 16) for name in names], max_distance)
+    return dict(zip(names, labels.tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build perceptual-hash indexes and report near-duplicate clusters.')
+    parser.add_argument('source_dirs', nargs='+', help='Corpus directories, e.g. ../Data/brain ../Data/lung')
+    parser.add_argument('--max-distance', type=int, default=6)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    for source_dir in args.source_dirs:
+        clusters = find_clusters(source_dir, max_distance=args.max_distance, workers=args.workers)
+        groups = {}
+        for name, label in clusters.items():
+            groups.setdefault(label, []).append(name)
+        duplicates = [members for members in groups.values() if len(members) > 1]
+        cross_class = [members for members in duplicates
+                       if len({member.split(os.sep)[0] for member in members}) > 1]
+        print(f"{source_dir}: {len(clusters)} images, {len(groups)} unique, "
+              f"{sum(len(m) - 1 for m in duplicates)} redundant in {len(duplicates)} clusters, "
+              f"{len(cross_class)} clusters span several classes")
+        for members in cross_class[:20]:
+            print(f"  conflicting labels: {', '.join(members)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,148 @@
 import os
+import json
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.model_selection import train_test_split
+from image_index import find_clusters
 
-def split_data(source_dir, train_dir, test_dir, test_size=0.2, random_state=42):
-    os.makedirs(train_dir, exist_ok=True)
-    os.makedirs(test_dir, exist_ok=True)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
 
-    for class_name in os.listdir(source_dir):
+
+def build_manifest(source_dir, test_size=0.2, random_state=42, max_distance=6, dedupe=False):
+    # The unit of the split is a near-duplicate cluster (perceptual hash), so
+    # duplicates of one scan never end up on both sides, even when they carry
+    # different labels. Each cluster is assigned a side once, stratified by
+    # its majority label, and every member follows it. Files are sorted first
+    # so the split only depends on the seed, not on directory listing order.
+    clusters = find_clusters(source_dir, max_distance=max_distance) if max_distance is not None else {}
+    groups = {}
+    for class_name in sorted(os.listdir(source_dir)):
         class_path = os.path.join(source_dir, class_name)
-        
         if not os.path.isdir(class_path):
             continue
+        for img in sorted(f for f in os.listdir(class_path) if f.lower().endswith(IMAGE_EXTENSIONS)):
+            rel = os.path.join(class_name, img)
+            groups.setdefault(clusters.get(rel, rel), []).append((class_name, img))
 
-        images = [f for f in os.listdir(class_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    by_majority = {}
+    conflicting = 0
+    for key, members in groups.items():
+        labels = [class_name for class_name, _ in members]
+        majority = max(sorted(set(labels)), key=labels.count)
+        conflicting += len(set(labels)) > 1
+        by_majority.setdefault(majority, []).append(key)
+    if conflicting:
+        print(f"Warning: {conflicting} near-duplicate clusters in {source_dir} carry more than one label, "
+              f"each is kept on one side (run image_index.py {source_dir} for details)")
 
-        train_imgs, test_imgs = train_test_split(
-            images, 
-            test_size=test_size, 
+    manifest = []
+    for majority in sorted(by_majority):
+        group_keys = sorted(by_majority[majority], key=lambda key: groups[key][0])
+        train_keys, test_keys = train_test_split(
+            group_keys,
+            test_size=test_size,
             random_state=random_state,
             shuffle=True
         )
-        
-        os.makedirs(os.path.join(train_dir, class_name), exist_ok=True)
-        os.makedirs(os.path.join(test_dir, class_name), exist_ok=True)
-        
-        for img in train_imgs:
-            src = os.path.join(class_path, img)
-            dst = os.path.join(train_dir, class_name, img)
-            shutil.copy2(src, dst)
-        
-        for img in test_imgs:
-            src = os.path.join(class_path, img)
-            dst = os.path.join(test_dir, class_name, img)
-            shutil.copy2(src, dst)
-        
-        print(f"Class '{class_name}': {len(train_imgs)} train, {len(test_imgs)} test")
-
-split_data("../Data/brain", "../Data/train", "../Data/test")
-split_data("../Data/lung", "../Data/train", "../Data/test")
\ No newline at end of file
+        for split, keys in (('train', train_keys), ('test', test_keys)):
+            for key in keys:
+                members = groups[key]
+                # Kept copy of the cluster: its first member with the majority label
+                keep = next(member for member in members if member[0] == majority)
+                for class_name, img in members:
+                    entry = {'class': class_name, 'file': img, 'split': split,
+                             'cluster': os.path.join(*keep)}
+                    if dedupe and (class_name, img) != keep:
+                        # Redundant copy: recorded, but not materialized
+                        entry['split'] = 'duplicate'
+                    manifest.append(entry)
+    manifest.sort(key=lambda entry: (entry['class'], entry['split'], entry['file']))
+    return manifest
+
+
+def _up_to_date(src, dst):
+    if not os.path.lexists(dst):
+        return False
+    try:
+        if os.path.samefile(src, dst):  # hardlink or symlink to the source
+            return True
+    except OSError:
+        return False
+    if os.path.islink(dst):
+        return False
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+def _place(src, dst, mode):
+    if _up_to_date(src, dst):
+        return 'skipped'
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode in ('auto', 'hardlink'):
+        try:
+            os.link(src, dst)
+            return 'linked'
+        except OSError:
+            if mode == 'hardlink':
+                raise
+    if mode in ('auto', 'symlink'):
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return 'linked'
+        except OSError:
+            if mode == 'symlink':
+                raise
+    shutil.copy2(src, dst)
+    return 'copied'
+
+
+def split_data(source_dir, train_dir, test_dir, test_size=0.2, random_state=42,
+               mode='auto', workers=16, manifest_path=None, max_distance=6, dedupe=False):
+    manifest = build_manifest(source_dir, test_size, random_state, max_distance, dedupe)
+    if manifest_path is None:
+        manifest_path = os.path.join(os.path.dirname(os.path.abspath(train_dir)),
+                                     f"{os.path.basename(os.path.normpath(source_dir))}_split.json")
+    with open(manifest_path, 'w') as f:
+        json.dump({
+            'source_dir': source_dir,
+            'test_size': test_size,
+            'random_state': random_state,
+            'max_distance': max_distance,
+            'files': manifest
+        }, f, indent=1)
+
+    split_dirs = {'train': train_dir, 'test': test_dir}
+    jobs = []
+    stale = []
+    for entry in manifest:
+        for split, split_dir in split_dirs.items():
+            dst = os.path.join(split_dir, entry['class'], entry['file'])
+            if split == entry['split']:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                jobs.append((os.path.join(source_dir, entry['class'], entry['file']), dst))
+            else:
+                # Left over from an earlier split, or a dropped duplicate
+                stale.append(dst)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(lambda job: _place(job[0], job[1], mode), jobs))
+    removed = 0
+    for path in stale:
+        if os.path.lexists(path):
+            os.remove(path)
+            removed += 1
+
+    counts = {}
+    for entry in manifest:
+        counts.setdefault(entry['class'], {'train': 0, 'test': 0, 'duplicate': 0})[entry['split']] += 1
+    for class_name, split_counts in counts.items():
+        print(f"Class '{class_name}': {split_counts['train']} train, {split_counts['test']} test"
+              + (f", {split_counts['duplicate']} duplicates dropped" if split_counts['duplicate'] else ''))
+    print(f"{outcomes.count('linked')} linked, {outcomes.count('copied')} copied, "
+          f"{outcomes.count('skipped')} unchanged, {removed} removed (manifest: {manifest_path})")
+
+
+if __name__ == '__main__':
+    split_data("../Data/brain", "../Data/train", "../Data/test")
+    split_data("../Data/lung", "../Data/train", "../Data/test")
@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import shutil
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+# Config-driven training runner. Each run trains one model in its own process,
+# pinned to a disjoint share of the CPU cores (affinity plus TF intra/inter-op
+# thread pools), so several models can train side by side without
+# oversubscribing the machine. TensorFlow is only imported in the workers.
+#
+#   python train_runner.py                         # brain and lung in parallel
+#   python train_runner.py --config runs.json --runs lung --set epochs=50
+#
+# Every epoch writes a full training-state checkpoint (weights, optimizer,
+# epoch, metric history) under checkpoint_dir/<name>; rerunning an
+# interrupted run resumes from it. With --finetune NEW_DIR each run starts
+# from the deployed model and trains only on NEW_DIR/<name> plus a replay
+# sample of its original training data. --profile records per-step telemetry
+# and a TF profiler trace into run_dir/<name>-<timestamp> (training_profiler).
+
+DEFAULTS = {
+    'architecture': 'baseline',
+    'params': {},
+    'img_size': [128, 128],
+    'batch_size': 8,
+    'epochs': 30,
+    'learning_rate': 1e-4,
+    'patience': 5,
+    'validation_split': 0.2,
+    'seed': 42,
+    'shard_dir': None,
+    'output': None,
+    'checkpoint_dir': 'checkpoints',
+    'init_from': None,
+    'new_data_dir': None,
+    'replay_ratio': 1.0,
+    'profile': False,
+    'profile_steps': [10, 20],
+    'run_dir': 'runs',
+}
+
+DEFAULT_CONFIG = {
+    'runs': [
+        {
+            'name': 'brain',
+            'data_dir': '../Data/train/brain',
+            'shard_dir': '../Data/shards/brain',
+            'class_mode': 'binary',
+            'output': 'brain_model.h5',
+        },
+        {
+            'name': 'lung',
+            'data_dir': '../Data/train/lung',
+            'shard_dir': '../Data/shards/lung',
+            'class_mode': 'categorical',
+            'output': 'lung_model.h5',
+        },
+    ]
+}
+
+
+def load_config(path=None):
+    config = DEFAULT_CONFIG
+    if path:
+        with open(path) as f:
+            config = json.load(f)
+    defaults = {**DEFAULTS, **config.get('defaults', {})}
+    return [{**defaults, **run} for run in config['runs']]
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(slots, cores_per_run=None):
+    cores = available_cores()
+    if cores_per_run:
+        cores = cores[:cores_per_run * slots]
+    return [[int(c) for c in part] or cores[:1] for part in np.array_split(cores, slots)]
+
+
+def configure_threads(cores):
+    # Must run before TensorFlow creates its thread pools, i.e. before any op
+    if cores:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        os.environ['OMP_NUM_THREADS'] = str(len(cores))
+    import tensorflow as tf
+    if cores:
+        tf.config.threading.set_intra_op_parallelism_threads(len(cores))
+        tf.config.threading.set_inter_op_parallelism_threads(min(2, len(cores)))
+
+
+def num_outputs(run):
+    if run['class_mode'] == 'binary':
+        return 1
+    return len([d for d in os.listdir(run['data_dir']) if os.path.isdir(os.path.join(run['data_dir'], d))])
+
+
+def train(run, cores=None, callbacks=None):
+    configure_threads(cores)
+    from tensorflow.keras.models import load_model
+    from tensorflow.keras.optimizers import Adam
+    from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, BackupAndRestore
+    from datasets import make_datasets, make_finetune_datasets, InputTimingCallback, TrainingStateCallback
+    from architectures import build_model
+
+    start = time.perf_counter()
+    img_size = tuple(run['img_size'])
+    if run['new_data_dir']:
+        train_ds, val_ds = make_finetune_datasets(
+            run['new_data_dir'],
+            run['data_dir'],
+            class_mode=run['class_mode'],
+            img_size=img_size,
+            batch_size=run['batch_size'],
+            replay_ratio=run['replay_ratio'],
+            validation_split=run['validation_split'],
+            seed=run['seed']
+        )
+    else:
+        train_ds, val_ds = make_datasets(
+            run['data_dir'],
+            class_mode=run['class_mode'],
+            img_size=img_size,
+            batch_size=run['batch_size'],
+            validation_split=run['validation_split'],
+            seed=run['seed'],
+            shard_dir=run['shard_dir']
+        )
+
+    if run['init_from']:
+        model = load_model(run['init_from'], compile=False)
+    else:
+        model = build_model(run['architecture'], img_size + (3,), num_outputs(run), **run['params'])
+    model.compile(
+        optimizer=Adam(learning_rate=run['learning_rate']),
+        loss='binary_crossentropy' if run['class_mode'] == 'binary' else 'categorical_crossentropy',
+        metrics=['accuracy']
+    )
+
+    timing = InputTimingCallback()
+    train_ds = timing.wrap(train_ds)
+    early_stopping = EarlyStopping(monitor='val_accuracy', patience=run['patience'])
+    run_callbacks = [early_stopping, timing]
+    resume = None
+    if run['checkpoint_dir']:
+        state_dir = os.path.join(run['checkpoint_dir'], run['name'])
+        os.makedirs(state_dir, exist_ok=True)
+        resume = TrainingStateCallback(os.path.join(state_dir, 'state.json'), early_stopping)
+        if resume.state['epochs']:
+            print(f"Resuming '{run['name']}' after epoch {max(map(int, resume.state['epochs'])) + 1}")
+        run_callbacks = [BackupAndRestore(os.path.join(state_dir, 'backup'))] + run_callbacks + [resume]
+    profiler = None
+    if run['profile']:
+        from training_profiler import TrainingProfiler
+        profile_dir = os.path.join(run['run_dir'], f"{run['name']}-{time.strftime('%Y%m%d-%H%M%S')}")
+        profiler = TrainingProfiler(profile_dir, run['batch_size'], timing, run['profile_steps'])
+        with open(os.path.join(profile_dir, 'config.json'), 'w') as f:
+            json.dump({'run': run, 'cores': cores}, f, indent=2)
+        run_callbacks.append(profiler)
+    if run['output']:
+        best = resume.state['best_val_accuracy'] if resume else None
+        # Don't let the first epoch after a resume overwrite a better model
+        run_callbacks.append(ModelCheckpoint(run['output'], monitor='val_accuracy', save_best_only=True,
+                                             mode='max', initial_value_threshold=best))
+    history = model.fit(
+        train_ds,
+        validation_data=val_ds,
+        epochs=run['epochs'],
+        callbacks=run_callbacks + list(callbacks or []),
+        verbose=2
+    )
+
+    if resume:
+        metrics = resume.history()
+        # Finished: nothing left to resume
+        shutil.rmtree(state_dir, ignore_errors=True)
+    else:
+        metrics = {key: [float(v) for v in values] for key, values in history.history.items()}
+    val_accuracy = metrics.get('val_accuracy', [])
+    return {
+        'name': run['name'],
+        'config': run,
+        'cores': cores,
+        'epochs_run': len(val_accuracy),
+        'best_val_accuracy': max(val_accuracy) if val_accuracy else None,
+        'metrics': metrics,
+        'input_timing': timing.history,
+        'wall_time_s': time.perf_counter() - start,
+        'profile': {'run_dir': profiler.run_dir, **profiler.summary()} if profiler else None,
+    }
+
+
+def run_parallel(runs, parallel=None, cores_per_run=None):
+    # A fresh spawned process per run: TF thread pools can't be resized once
+    # created, and forking a process that already holds TF state is unsafe
+    parallel = max(1, min(parallel or len(runs), len(runs)))
+    free_slots = partition_cores(parallel, cores_per_run)
+    pending = list(runs)
+    running = {}
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=parallel, mp_context=context, max_tasks_per_child=1) as pool:
+        while pending or running:
+            while pending and free_slots:
+                run, cores = pending.pop(0), free_slots.pop(0)
+                print(f"Starting '{run['name']}' on cores {cores}")
+                running[pool.submit(train, run, cores)] = (run, cores)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                run, cores = running.pop(future)
+                free_slots.append(cores)
+                try:
+                    result = future.result()
+                    print(f"Finished '{run['name']}': best val_accuracy {result['best_val_accuracy']} "
+                          f"after {result['epochs_run']} epochs in {result['wall_time_s']:.0f}s")
+                except Exception as e:
+                    result = {'name': run['name'], 'config': run, 'cores': cores, 'error': str(e)}
+                    print(f"Run '{run['name']}' failed: {str(e)}")
+                results.append(result)
+    return results
+
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        try:
+            overrides[key] = json.loads(value)
+        except json.JSONDecodeError:
+            overrides[key] = value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train one or more models from a config, in parallel processes.')
+    parser.add_argument('--config', help='JSON file with optional "defaults" and a list of "runs"')
+    parser.add_argument('--runs', nargs='+', help='Only train the runs with these names')
+    parser.add_argument('--parallel', type=int, default=None, help='Concurrent runs (default: all of them)')
+    parser.add_argument('--cores-per-run', type=int, default=None, help='Default: split all available cores')
+    parser.add_argument('--set', nargs='+', metavar='KEY=VALUE', help='Override a setting for every run')
+    parser.add_argument('--finetune', metavar='NEW_DIR',
+                        help='Fine-tune the deployed models on NEW_DIR/<run name> plus replayed old data')
+    parser.add_argument('--profile', action='store_true', help='Record step telemetry and a TF profiler trace')
+    parser.add_argument('--profile-steps', type=int, nargs=2, metavar=('START', 'STOP'),
+                        help='Global step range for the TF profiler trace (default: 10 20)')
+    parser.add_argument('--deployed-dir', default='HealthWave/models', help='Where --finetune finds the models')
+    parser.add_argument('--results', default='training_results.json')
+    args = parser.parse_args()
+
+    overrides = parse_overrides(args.set)
+    if args.profile:
+        overrides['profile'] = True
+    if args.profile_steps:
+        overrides['profile_steps'] = args.profile_steps
+    runs = [{**run, **overrides} for run in load_config(args.config)
+            if not args.runs or run['name'] in args.runs]
+    if not runs:
+        parser.error('No runs selected')
+    if args.finetune:
+        for run in runs:
+            run['new_data_dir'] = os.path.join(args.finetune, run['name'])
+            run['init_from'] = run['init_from'] or os.path.join(args.deployed_dir, f"{run['name']}_model.h5")
+            # Separate state and output from a full training run of the same name
+            run['name'] = f"{run['name']}-finetune"
+            if run['output']:
+                root, ext = os.path.splitext(run['output'])
+                run['output'] = f"{root}_finetune{ext}"
+
+    results = run_parallel(runs, args.parallel, args.cores_per_run)
+    with open(args.results, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.results}")
+    if any('error' in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import os
+import csv
+import json
+import time
+import resource
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
+
+# Per-step training telemetry. The input wait / compute split of each step
+# comes from datasets.InputTimingCallback, which must come earlier in the
+# callback list and wrap the training dataset. Writes into one run directory:
+#   steps.csv     step, epoch, input wait and compute time of every batch
+#   epochs.jsonl  per-epoch percentiles, throughput and peak RSS
+#   trace/        TensorFlow profiler trace for the chosen step range
+#   summary.json  totals and the likely bottleneck (input, compute or memory)
+
+INPUT_BOUND_SHARE = 0.25
+MEMORY_BOUND_SHARE = 0.85
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_bytes():
+    # Lifetime peak of the process, never goes down; ru_maxrss is in
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _total_memory_bytes():
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class TrainingProfiler(Callback):
+    def __init__(self, run_dir, batch_size, timing, profile_steps=None):
+        super().__init__()
+        self.run_dir = run_dir
+        self.timing = timing
+        self.batch_size = batch_size
+        self.profile_steps = profile_steps
+        self.epochs = []
+        self._step = 0
+        self._tracing = False
+        os.makedirs(run_dir, exist_ok=True)
+
+    def on_train_begin(self, logs=None):
+        self._steps_file = open(os.path.join(self.run_dir, 'steps.csv'), 'w', newline='')
+        self._steps_writer = csv.writer(self._steps_file)
+        self._steps_writer.writerow(['step', 'epoch', 'batch', 'input_wait_ms', 'compute_ms', 'rss_bytes'])
+        self._train_start = time.perf_counter()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+        self._waits = []
+        self._step_times = []
+        self._epoch_peak_rss = _rss_bytes()
+        self._epoch_start = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.profile_steps and self._step == self.profile_steps[0] and not self._tracing:
+            tf.profiler.experimental.start(os.path.join(self.run_dir, 'trace'))
+            self._tracing = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        wait, compute = self.timing.last_wait, self.timing.last_compute
+        if self._step:
+            # Step 0 is mostly tracing the train function; keep it out of the totals
+            self._waits.append(wait)
+            self._step_times.append(compute)
+        rss = _rss_bytes()
+        if rss is not None:
+            # Peak of this epoch alone, sampled once per step
+            self._epoch_peak_rss = max(self._epoch_peak_rss or 0, rss)
+        self._steps_writer.writerow([self._step, self._epoch, batch, f"{wait * 1000:.3f}",
+                                     f"{compute * 1000:.3f}", rss])
+        self._step += 1
+        if self._tracing and self._step >= self.profile_steps[1]:
+            self._stop_trace()
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._epoch_start
+        waits, step_times = np.array(self._waits), np.array(self._step_times)
+        busy = waits.sum() + step_times.sum()
+        row = {
+            'epoch': epoch + 1,
+            'steps': len(step_times),
+            'epoch_s': elapsed,
+            'compute_ms_p50': float(np.percentile(step_times, 50) * 1000) if len(step_times) else None,
+            'compute_ms_p95': float(np.percentile(step_times, 95) * 1000) if len(step_times) else None,
+            'input_wait_s': float(waits.sum()),
+            'compute_s': float(step_times.sum()),
+            'input_wait_share': float(waits.sum() / busy) if busy else 0.0,
+            'train_images_per_sec': len(step_times) * self.batch_size / busy if busy else None,
+            'peak_rss_bytes': self._epoch_peak_rss,
+            'lifetime_peak_rss_bytes': _peak_rss_bytes(),
+            'logs': {key: float(value) for key, value in (logs or {}).items()},
+        }
+        self.epochs.append(row)
+        with open(os.path.join(self.run_dir, 'epochs.jsonl'), 'a') as f:
+            f.write(json.dumps(row) + '\n')
+        self._steps_file.flush()
+
+    def on_train_end(self, logs=None):
+        if self._tracing:
+            self._stop_trace()
+        self._steps_file.close()
+        summary = self.summary()
+        with open(os.path.join(self.run_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nProfile written to {self.run_dir}: {summary['bottleneck']}-bound. {summary['advice']}")
+
+    def _stop_trace(self):
+        tf.profiler.experimental.stop()
+        self._tracing = False
+
+    def summary(self):
+        wait = sum(row['input_wait_s'] for row in self.epochs)
+        compute = sum(row['compute_s'] for row in self.epochs)
+        wait_share = wait / (wait + compute) if wait + compute else 0.0
+        peak_rss = _peak_rss_bytes()
+        total_memory = _total_memory_bytes()
+        memory_share = peak_rss / total_memory if total_memory else None
+
+        if memory_share is not None and memory_share > MEMORY_BOUND_SHARE:
+            bottleneck = 'memory'
+            advice = 'Peak RSS is close to physical memory: lower batch_size or stop caching decoded images in RAM.'
+        elif wait_share > INPUT_BOUND_SHARE:
+            bottleneck = 'input'
+            advice = ('Steps wait on the input pipeline: use pre-decoded shards (shard_dir), '
+                      'more decode parallelism or fewer cores for compute.')
+        else:
+            bottleneck = 'compute'
+            advice = 'The input pipeline keeps up: a larger batch_size or more intra-op threads should help.'
+        throughputs = [row['train_images_per_sec'] for row in self.epochs if row['train_images_per_sec']]
+        return {
+            'epochs': len(self.epochs),
+            'steps': self._step,
+            'wall_time_s': time.perf_counter() - self._train_start,
+            'input_wait_share': wait_share,
+            'train_images_per_sec': float(np.median(throughputs)) if throughputs else None,
+            'lifetime_peak_rss_bytes': peak_rss,
+            'total_memory_bytes': total_memory,
+            'profiled_steps': self.profile_steps,
+            'bottleneck': bottleneck,
+            'advice': advice,
+        }